@@ -0,0 +1,46 @@
+import os, asyncio
+from typing import Any, Dict
+
+# Generations allowed to run at once, how many may wait for a slot, and for how long
+MAX_INFLIGHT = int(os.getenv("GEN_MAX_INFLIGHT", "100"))
+MAX_QUEUE = int(os.getenv("GEN_MAX_QUEUE", "400"))
+QUEUE_TIMEOUT = float(os.getenv("GEN_QUEUE_TIMEOUT", "10"))
+RETRY_AFTER = int(os.getenv("GEN_RETRY_AFTER", "5"))
+
+class Saturated(Exception):
+    pass
+
+class Admission:
+    # In-flight cap plus a bounded wait queue; past that, callers are turned away at once
+    def __init__(self, max_inflight: int = MAX_INFLIGHT, max_queue: int = MAX_QUEUE, queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._sem = asyncio.Semaphore(max_inflight)
+
+    async def acquire(self):
+        if self._sem.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Saturated("generation queue full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Saturated("timed out waiting for a generation slot")
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+
+    def release(self):
+        self.inflight -= 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"inflight": self.inflight, "waiting": self.waiting, "rejected": self.rejected,
+                "max_inflight": self.max_inflight, "max_queue": self.max_queue}
+
+ADMISSION = Admission()
@@ -0,0 +1,250 @@
+import bisect, csv, json, mmap, re, struct
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+# Items are stored sorted by (category, price), so each category is a contiguous
+# id range ordered by price. Indexes are Python ints used as bitsets over item ids.
+
+_PRICE_JUNK = re.compile(r"[^\d.,]")
+
+def parse_price(value: Any) -> Optional[float]:
+    # numbers as they are; display prices like "€39,99" or "1.299,00 €", where the last
+    # separator is the decimal one. None when there is no number in it
+    if isinstance(value, (int, float)): return float(value)
+    digits = _PRICE_JUNK.sub("", str(value))
+    i = max(digits.rfind("."), digits.rfind(","))
+    if i >= 0: digits = digits[:i].replace(".", "").replace(",", "") + "." + digits[i + 1:]
+    try: return float(digits)
+    except ValueError: return None
+
+def _price(item: Dict[str, Any]) -> float:
+    return parse_price(item.get("extracted_price") or item.get("price") or 0) or 0.0
+
+def _to_bits(ids: List[int], n: int) -> int:
+    buf = bytearray((n + 7) // 8)
+    for i in ids: buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+def _all_bits(mask: int) -> List[int]:
+    s = bin(mask)[:1:-1]  # least significant bit first
+    out, i = [], s.find("1")
+    while i >= 0:
+        out.append(i)
+        i = s.find("1", i + 1)
+    return out
+
+def _range_bits(lo: int, hi: int) -> int:
+    return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+def _bits_desc(mask: int, limit: int):
+    while mask and limit:
+        b = mask.bit_length() - 1
+        yield b
+        mask ^= 1 << b
+        limit -= 1
+
+def _bits_asc(mask: int, limit: int):
+    while mask and limit:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+        limit -= 1
+
+class Catalog:
+    def __init__(self, items: Iterable[Dict[str, Any]]):
+        rows = sorted(items, key=lambda i: (i["category"], _price(i)))
+        self.items: List[Dict[str, Any]] = rows
+        self.prices: List[float] = [_price(i) for i in rows]
+        self.ranges: Dict[str, tuple] = {}
+        cats, genders, styles, colors = {}, {}, {}, {}
+        for idx, item in enumerate(rows):
+            cat = item["category"]
+            lo, _ = self.ranges.get(cat, (idx, idx))
+            self.ranges[cat] = (lo, idx + 1)
+            cats.setdefault(cat, []).append(idx)
+            genders.setdefault((item.get("gender") or "unisex").lower(), []).append(idx)
+            for s in item.get("styles") or []:
+                styles.setdefault(s, []).append(idx)
+            colors.setdefault((item.get("color") or "").lower(), []).append(idx)
+        n = len(rows)
+        self.by_category = {k: _to_bits(v, n) for k, v in cats.items()}
+        self.by_gender = {k: _to_bits(v, n) for k, v in genders.items()}
+        self.by_style = {k: _to_bits(v, n) for k, v in styles.items()}
+        self.by_color = {k: _to_bits(v, n) for k, v in colors.items()}
+
+    def __len__(self):
+        return len(self.items)
+
+    def mask(self, category: str, gender: str, styles: List[str], colors: Iterable[str]) -> int:
+        m = self.by_category.get(category, 0)
+        if not m: return 0
+        m &= self.by_gender.get("unisex", 0) | self.by_gender.get(gender, 0)
+        if styles:
+            sm = 0
+            for s in styles: sm |= self.by_style.get(s, 0)
+            m &= sm
+        cm = 0
+        for c in colors: cm |= self.by_color.get(c.lower(), 0)
+        return m & cm
+
+    def search(self, category: str, gender: str, styles: List[str], colors: Iterable[str],
+               price_cap: Optional[float] = None, limit: int = 32) -> List[Dict[str, Any]]:
+        # Without a cap: every match, cheapest first. With a cap: up to `limit` matches on
+        # each side of the cap (within +10%), plus the cheapest match, cheapest first.
+        m = self.mask(category, gender, styles, colors)
+        if not m: return []
+        if price_cap is None:
+            return [self.items[i] for i in _all_bits(m)]
+        lo, hi = self.ranges[category]
+        cap_at = bisect.bisect_right(self.prices, price_cap, lo, hi)
+        top_at = bisect.bisect_right(self.prices, price_cap * 1.1, lo, hi)
+        ids = set(_bits_desc(m & _range_bits(lo, cap_at), limit))
+        ids.update(_bits_asc(m & _range_bits(cap_at, top_at), limit))
+        ids.update(_bits_asc(m, 1))
+        return [self.items[i] for i in sorted(ids)]
+
+# --- On-disk columnar format -------------------------------------------------
+#
+# MAGIC | u32 header length | JSON header | 8-aligned sections
+# Sections: fixed-width columns (price f64, category u8, gender u8, color u16,
+# styles u32 bitmask, currency u8), string columns (u32 offsets + utf-8 blob)
+# and the precomputed index bitsets, so opening a file is a header parse plus
+# a few small int.from_bytes copies. Rows are stored sorted by (category, price).
+
+MAGIC = b"ANNACAT1"
+STRING_COLUMNS = ("title", "link", "source", "thumbnail")
+
+def write_catalog(items: Iterable[Dict[str, Any]], path: str) -> int:
+    rows = sorted(items, key=lambda i: (i["category"], _price(i)))
+    n = len(rows)
+    codes = {"category": {}, "gender": {}, "color": {}, "style": {}, "currency": {}}
+    def code(kind, value):
+        return codes[kind].setdefault(value, len(codes[kind]))
+    cat_c, gen_c, col_c, sty_m, cur_c = (array("B"), array("B"), array("H"), array("I"), array("B"))
+    prices = array("d")
+    strings = {k: (array("I", [0]), bytearray()) for k in STRING_COLUMNS}
+    for item in rows:
+        prices.append(_price(item))
+        cat_c.append(code("category", item["category"]))
+        gen_c.append(code("gender", (item.get("gender") or "unisex").lower()))
+        col_c.append(code("color", (item.get("color") or "").lower()))
+        mask = 0
+        for s in item.get("styles") or []: mask |= 1 << code("style", s)
+        sty_m.append(mask)
+        cur_c.append(code("currency", item.get("currency") or "EUR"))
+        for k, (offs, blob) in strings.items():
+            blob += (item.get(k) or "").encode("utf-8")
+            offs.append(len(blob))
+    if len(codes["style"]) > 32: raise ValueError("at most 32 distinct styles fit the style bitmask")
+
+    index = Catalog(rows)
+    sections: List[tuple] = [("price", prices.tobytes()), ("category", cat_c.tobytes()), ("gender", gen_c.tobytes()),
+                             ("color", col_c.tobytes()), ("styles", sty_m.tobytes()), ("currency", cur_c.tobytes())]
+    for k, (offs, blob) in strings.items():
+        sections += [(f"{k}.offsets", offs.tobytes()), (f"{k}.blob", bytes(blob))]
+    for kind, bitsets in (("category", index.by_category), ("gender", index.by_gender),
+                          ("style", index.by_style), ("color", index.by_color)):
+        for value, bits in bitsets.items():
+            sections.append((f"bits.{kind}.{value}", bits.to_bytes((n + 7) // 8, "little")))
+
+    header = {"rows": n, "ranges": index.ranges,
+              "codes": {k: sorted(v, key=v.get) for k, v in codes.items()}, "sections": {}}
+    # Offsets depend on the header length, so lay out relative to the data start first
+    pos = 0
+    for name, data in sections:
+        header["sections"][name] = [pos, len(data)]
+        pos += len(data) + (-len(data) % 8)
+    head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    start = len(MAGIC) + 4 + len(head)
+    start += -start % 8
+    with open(path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(head)) + head)
+        f.write(b"\0" * (start - f.tell()))
+        for _, data in sections:
+            f.write(data + b"\0" * (-len(data) % 8))
+    return n
+
+class _MappedRows:
+    # Sequence view that builds an item dict only for the rows actually returned
+    def __init__(self, cat: "MappedCatalog"):
+        self._c = cat
+
+    def __len__(self):
+        return self._c.rows
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        c = self._c
+        codes = c.codes
+        item = {
+            "category": codes["category"][c.col["category"][i]],
+            "price": c.prices[i],
+            "currency": codes["currency"][c.col["currency"][i]],
+            "gender": codes["gender"][c.col["gender"][i]],
+            "styles": [s for b, s in enumerate(codes["style"]) if c.col["styles"][i] >> b & 1],
+            "color": codes["color"][c.col["color"][i]],
+        }
+        for k in STRING_COLUMNS:
+            offs, lo = c.col[f"{k}.offsets"], c.blobs[k]
+            item[k] = bytes(lo[offs[i]:offs[i + 1]]).decode("utf-8") or None
+        return item
+
+class MappedCatalog(Catalog):
+    # Read-only mmap of a write_catalog file; pages are shared between worker processes
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC: raise ValueError(f"{path} is not an Anna catalog file")
+        (hlen,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        hstart = len(MAGIC) + 4
+        header = json.loads(self._mm[hstart:hstart + hlen].decode("utf-8"))
+        start = hstart + hlen
+        start += -start % 8
+        view = memoryview(self._mm)
+        def section(name):
+            off, size = header["sections"][name]
+            return view[start + off:start + off + size]
+        self.rows = header["rows"]
+        self.codes = header["codes"]
+        self.ranges = {k: tuple(v) for k, v in header["ranges"].items()}
+        fmt = {"price": "d", "category": "B", "gender": "B", "color": "H", "styles": "I", "currency": "B"}
+        self.col = {k: section(k).cast(f) for k, f in fmt.items()}
+        self.blobs = {}
+        for k in STRING_COLUMNS:
+            self.col[f"{k}.offsets"] = section(f"{k}.offsets").cast("I")
+            self.blobs[k] = section(f"{k}.blob")
+        self.prices = self.col["price"]
+        self.items = _MappedRows(self)
+        bits = {"category": {}, "gender": {}, "style": {}, "color": {}}
+        for name in header["sections"]:
+            if name.startswith("bits."):
+                _, kind, value = name.split(".", 2)
+                bits[kind][value] = int.from_bytes(section(name), "little")
+        self.by_category, self.by_gender = bits["category"], bits["gender"]
+        self.by_style, self.by_color = bits["style"], bits["color"]
+
+    def close(self):
+        self.col.clear(); self.blobs.clear()
+        self.prices = None
+        self._mm.close()
+        self._file.close()
+
+def _read_items(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            items = list(csv.DictReader(f))
+            for it in items:
+                it["styles"] = [s.strip() for s in re.split(r"[|;]", it.get("styles") or "") if s.strip()]
+            return items
+        return [json.loads(line) for line in f if line.strip()]
+
+def load_catalog(path: str) -> Catalog:
+    if path.endswith((".csv", ".jsonl")): return Catalog(_read_items(path))
+    return MappedCatalog(path)
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Build a columnar catalog file from CSV or JSONL.")
+    ap.add_argument("source", help="items as .jsonl (one JSON object per line) or .csv (styles separated by |)")
+    ap.add_argument("output", help="catalog file to write, e.g. catalog.annacat")
+    a = ap.parse_args()
+    print(f"wrote {write_catalog(_read_items(a.source), a.output)} items to {a.output}")
@@ -0,0 +1,148 @@
+import os, re, time, asyncio, threading, urllib.parse
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import Counter
+from shared_db import connect, db_path as shared_path
+from style_presets import COUNTRY_SHOPS
+
+# What link resolution has learned, kept longer than the SerpAPI cache and optionally on
+# disk (LINK_INDEX_DB): merchant name -> shop domain per country, seeded from COUNTRY_SHOPS,
+# and product -> resolved direct URL. A product resolved once is a local lookup after that;
+# only products not seen before cost a product lookup or web search.
+MERCHANT_TTL = float(os.getenv("LINK_INDEX_MERCHANT_TTL", str(90 * 86400)))
+PRODUCT_TTL = float(os.getenv("LINK_INDEX_PRODUCT_TTL", str(14 * 86400)))
+MIN_CONFIDENCE = float(os.getenv("LINK_INDEX_MIN_CONFIDENCE", "0.5"))
+SEED_CONFIDENCE = 0.6
+
+LINK_INDEX_LOOKUPS = Counter("anna_link_index_total", "Link index lookups", ("kind", "result"))
+
+def merchant_key(merchant: str) -> str:
+    # same flattening as the host match in link resolution: "H&M" -> "hm", "Zalando.nl" -> "zalandonl"
+    return re.sub(r"[^a-z0-9]+", "", (merchant or "").lower())
+
+def host_of(url: str) -> str:
+    try: return urllib.parse.urlparse(url).netloc.lower().split(":")[0]
+    except ValueError: return ""
+
+def on_domain(host: str, domain: str) -> bool:
+    return host == domain or host.endswith("." + domain)
+
+def registrable(host: str) -> str:
+    # www2.hm.com -> hm.com, www.zalando.co.uk -> zalando.co.uk
+    parts = host.split(".")
+    n = 3 if len(parts) > 2 and parts[-2] in ("co", "com", "org") and len(parts[-1]) == 2 else 2
+    return ".".join(parts[-n:])
+
+def merchant_host(merchant: str, host: str) -> bool:
+    # the host is named after the merchant as a whole: "H&M" on www2.hm.com, "Zalando.nl" on
+    # zalando.nl; not "On" on zalando.nl
+    kw, reg = merchant_key(merchant), registrable(host)
+    return bool(kw) and kw in (merchant_key(reg.split(".")[0]), merchant_key(reg))
+
+class LinkIndex:
+    def __init__(self, db_path: Optional[str] = None, merchant_ttl: float = MERCHANT_TTL,
+                 product_ttl: float = PRODUCT_TTL, min_confidence: float = MIN_CONFIDENCE):
+        self.merchant_ttl = merchant_ttl
+        self.product_ttl = product_ttl
+        self.min_confidence = min_confidence
+        # (key, gl) -> (value, confidence, expires); seeds never expire
+        self._merchants: Dict[Tuple[str, str], tuple] = {}
+        self._products: Dict[Tuple[str, str], tuple] = {}
+        self._seeds: Dict[str, Dict[str, str]] = {}  # gl -> {merchant key: domain}
+        self._lock = threading.Lock()
+        self.counts = {"product_hits": 0, "merchant_hits": 0, "learned": 0, "contradicted": 0}
+        for country, shops in COUNTRY_SHOPS.items():
+            # a merchant matches on the whole registrable label ("hm" for hm.com, "next" for
+            # next.co.uk) or on the whole flattened domain ("zalandonl"), never on a part of one
+            seeds = self._seeds[country.lower()] = {}
+            for d in shops:
+                seeds.setdefault(merchant_key(d), d)
+                seeds.setdefault(registrable(d).split(".")[0], d)
+        self._db = None
+        if db_path:
+            self._db = connect(db_path)
+            for table in ("link_merchants", "link_products"):
+                self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT, gl TEXT, value TEXT, confidence REAL, expires REAL, PRIMARY KEY (key, gl))")
+                self._db.execute(f"DELETE FROM {table} WHERE expires < ?", (time.time(),))
+            self._db.commit()
+            for table, mem in (("link_merchants", self._merchants), ("link_products", self._products)):
+                for key, gl, value, conf, expires in self._db.execute(f"SELECT key, gl, value, confidence, expires FROM {table}"):
+                    mem[(key, gl)] = (value, conf, expires)
+
+    def domain(self, merchant: str, gl: str) -> Optional[str]:
+        # the merchant's shop domain in this country, if known well enough
+        kw = merchant_key(merchant)
+        if not kw: return None
+        now = time.time()
+        with self._lock:
+            hit = self._load("link_merchants", self._merchants, (kw, gl))
+        if hit and hit[2] > now and hit[1] >= self.min_confidence:
+            self.counts["merchant_hits"] += 1
+            LINK_INDEX_LOOKUPS.inc("merchant", "learned")
+            return hit[0]
+        d = self._seeds.get(gl, {}).get(kw)
+        if d:
+            LINK_INDEX_LOOKUPS.inc("merchant", "seed")
+            return d
+        LINK_INDEX_LOOKUPS.inc("merchant", "miss")
+        return None
+
+    def product(self, key: str, gl: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            hit = self._load("link_products", self._products, (key, gl))
+        if hit and hit[2] > now:
+            self.counts["product_hits"] += 1
+            LINK_INDEX_LOOKUPS.inc("product", "hit")
+            return hit[0]
+        LINK_INDEX_LOOKUPS.inc("product", "miss")
+        return None
+
+    def learn(self, key: str, gl: str, url: str, merchant: str = ""):
+        # a direct product URL the resolver settled on; with `merchant`, the URL is known to be
+        # that merchant's shop, which confirms (or contradicts) the domain we have for it
+        now = time.time()
+        host = host_of(url)
+        if not host: return
+        rows = [("link_products", key, url, 1.0, now + self.product_ttl)]
+        with self._lock:
+            self._products[(key, gl)] = (url, 1.0, now + self.product_ttl)
+            kw = merchant_key(merchant)
+            if kw:
+                domain, conf, _ = self._load("link_merchants", self._merchants, (kw, gl)) or (registrable(host), SEED_CONFIDENCE, 0)
+                if on_domain(host, domain):
+                    conf = conf + (1 - conf) / 2
+                else:
+                    # another shop under this merchant name: trust drops, and a weak entry is replaced
+                    self.counts["contradicted"] += 1
+                    conf = conf / 2
+                    if conf < self.min_confidence / 2:
+                        domain, conf = registrable(host), SEED_CONFIDENCE
+                self._merchants[(kw, gl)] = (domain, conf, now + self.merchant_ttl)
+                rows.append(("link_merchants", kw, domain, conf, now + self.merchant_ttl))
+            self.counts["learned"] += 1
+            if self._db is not None:
+                for table, k, value, c, expires in rows:
+                    self._db.execute(f"INSERT OR REPLACE INTO {table} (key, gl, value, confidence, expires) VALUES (?, ?, ?, ?, ?)",
+                                     (k, gl, value, c, expires))
+                self._db.commit()
+
+    async def alearn(self, key: str, gl: str, url: str, merchant: str = ""):
+        # learn() for the event loop: with a database the commit can wait on other workers
+        if self._db is None: return self.learn(key, gl, url, merchant)
+        await asyncio.to_thread(self.learn, key, gl, url, merchant)
+
+    def _load(self, table: str, mem: Dict[Tuple[str, str], tuple], key: Tuple[str, str]) -> Optional[tuple]:
+        # memory first; on a miss, what other processes sharing the database learned since we started
+        hit = mem.get(key)
+        if hit is None and self._db is not None:
+            row = self._db.execute(f"SELECT value, confidence, expires FROM {table} WHERE key = ? AND gl = ?", key).fetchone()
+            if row: hit = mem[key] = tuple(row)
+        return hit
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counts, merchants=len(self._merchants), products=len(self._products),
+                        seeded=sum(len(set(v.values())) for v in self._seeds.values()), persistent=self._db is not None)
+
+LINK_INDEX = LinkIndex(db_path=shared_path("links.db", "LINK_INDEX_DB"))
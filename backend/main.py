@@ -1,11 +1,36 @@
-import os, re, urllib.parse, requests
+import os, json, zlib, asyncio
 from typing import List, Optional, Dict, Any
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 
-app = FastAPI(title="Anna MVP API (Reboot)", version="1.0.0")
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+from serp_cache import SERP_CACHE
+from serp_client import ASYNC_SERP_CLIENT
+from admission import ADMISSION, RETRY_AFTER, Saturated
+from quota import QUOTA
+from prewarm import PREWARMER
+from link_index import LINK_INDEX
+from metrics import SERVER_TIMING, render as render_metrics, server_timing, span
+from payload import FORMATS, compact, dumps
+from pipeline import Memo, generate as run_pipeline, iter_generate, iter_generate_batch
+from response_cache import RESPONSE_CACHE, etag_matches, response_key
+from search_backends import BACKENDS, SearchBackend, backend_for, refresh as serp_refresh
+from sessions import SESSIONS
+from shared_db import STATE_DIR, private_dir
+from thumbs import MAX_AGE as THUMB_MAX_AGE, THUMBS, ThumbError
+
+BATCH_MAX_INTAKES = int(os.getenv("BATCH_MAX_INTAKES", "500"))
+# Responses from GZIP_MIN_SIZE bytes on are gzipped for clients that accept it
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+
+app = FastAPI(title="Anna MVP API (Reboot)", version="1.0.0", default_response_class=ORJSONResponse)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["ETag", "X-Cache", "X-Session", "Server-Timing"])
+# NDJSON streams compress themselves (_stream); the middleware leaves those alone
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
 
 class Intake(BaseModel):
     purpose: str
@@ -14,7 +39,7 @@ class Intake(BaseModel):
     fit: Optional[str] = None
     age_range: Optional[str] = None
     country: str = "NL"
-    currency: Optional[str] = "EUR"
+    currency: Optional[str] = None  # default: the country's (style_presets.CURRENCY_BY_COUNTRY)
     budget_total: Optional[float] = 250
     budget_per_item: Optional[float] = None
     sizes: Optional[Dict[str, str]] = None
@@ -28,240 +53,368 @@ class GenerateRequest(BaseModel):
     mode: Optional[str] = "serpapi"
     serpapi_api_key: Optional[str] = None
     outfits_count: int = 3
+    format: Optional[str] = "full"  # or "compact": items once, outfits refer to them by index
+
+class DeltaRequest(BaseModel):
+    # follow-up on an earlier generation: only these may change
+    session: str
+    budget_total: Optional[float] = None
+    budget_per_item: Optional[float] = None
+    outfits_count: Optional[int] = None
+    format: Optional[str] = "full"
 
+class BatchRequest(BaseModel):
+    intakes: List[Intake]
+    mode: Optional[str] = "serpapi"
+    serpapi_api_key: Optional[str] = None
+    outfits_count: int = 3
+    format: Optional[str] = "full"  # or "compact": items once, outfits refer to them by index
+
+# stats read the shared SQLite files and take the locks their writers hold: plain `def`,
+# so FastAPI runs them on its threadpool instead of the event loop
 @app.get("/api/meta")
 def meta():
     return {
         "has_serpapi": bool(os.getenv("SERPAPI_API_KEY", "")),
-        "version": "1.0.0"
+        "modes": list(BACKENDS),
+        "version": "1.0.0",
+        "cache": SERP_CACHE.stats(),
+        "upstream": ASYNC_SERP_CLIENT.stats(),
+        "admission": ADMISSION.stats(),
+        "response_cache": RESPONSE_CACHE.stats(),
+        "prewarm": PREWARMER.stats(),
+        "link_index": LINK_INDEX.stats(),
+        "sessions": SESSIONS.stats(),
+        "thumbs": THUMBS.stats(),
     }
 
+@app.get("/api/quota")
+def quota():
+    # SerpAPI usage per key (by fingerprint) against the configured plan
+    return QUOTA.stats()
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text exposition
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/img")
+async def img(u: str, s: str = "", if_none_match: Optional[str] = Header(None)):
+    # item thumbnails as small WebP from our own disk cache; only for links found in our results
+    if not THUMBS.verify(u, s):
+        raise HTTPException(status_code=403, detail="Ongeldige afbeeldingslink.")
+    try:
+        digest, data = await THUMBS.get(u)
+    except ThumbError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+    # identity keeps GZipMiddleware off already-compressed WebP
+    headers = {"ETag": f'"{digest}"', "Cache-Control": f"public, max-age={THUMB_MAX_AGE}, immutable",
+               "Content-Encoding": "identity"}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(data, media_type="image/webp", headers=headers)
+
+@app.on_event("startup")
+async def _start_prewarm():
+    # popular lookups are refreshed with the server's own key, never a visitor's
+    PREWARMER.start(os.getenv("SERPAPI_API_KEY", ""), serp_refresh)
+
+@app.on_event("shutdown")
+async def _close_clients():
+    await PREWARMER.stop()
+    await ASYNC_SERP_CLIENT.aclose()
+    await THUMBS.aclose()
+
+async def _admit():
+    try:
+        await ADMISSION.acquire()
+    except Saturated as e:
+        raise HTTPException(status_code=503, detail=f"Druk bezig, probeer het zo opnieuw ({e}).",
+                            headers={"Retry-After": str(RETRY_AFTER)})
+
+def _usage(backend: SearchBackend) -> Optional[dict]:
+    # what a request that made no lookups of its own reports (cache hit, joined another's run)
+    usage = backend.usage()
+    return usage.report() if usage is not None else None
+
+def _with_usage(body: bytes, usage: Optional[dict]) -> bytes:
+    # usage is per request, so it's never part of the cached body; spliced into the JSON object here
+    if usage is None: return body
+    return body[:-1] + b',"usage":' + dumps(usage) + b"}"
+
+def _cached(entry, state: str, if_none_match: Optional[str], stream: bool = False, session=None,
+            fmt: Optional[str] = None, accept_encoding: Optional[str] = None, usage: Optional[dict] = None) -> Response:
+    # 304 when the client already has this version, else the cached body in the requested format
+    body, etag = entry.representation(fmt)
+    headers = {"ETag": etag, "X-Cache": state, "Cache-Control": "no-cache"}
+    if session is not None: headers["X-Session"] = session.token
+    if etag_matches(if_none_match, etag):
+        RESPONSE_CACHE.count("not_modified")
+        return Response(status_code=304, headers=headers)
+    RESPONSE_CACHE.count(state)
+    if stream:
+        return _stream(_replay(entry, session, fmt, usage), accept_encoding, headers=headers)
+    return Response(_with_usage(body, usage), media_type="application/json", headers=headers)
+
+def _format(fmt: Optional[str]) -> str:
+    fmt = (fmt or "full").lower()
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Onbekend formaat '{fmt}'; kies uit {', '.join(FORMATS)}.")
+    return fmt
+
+def _backend(mode: Optional[str], api_key: Optional[str]) -> Optional[SearchBackend]:
+    # None for serpapi mode without a key; 400 for a mode that doesn't exist or can't run here
+    key = (api_key or "").strip() or os.getenv("SERPAPI_API_KEY", "")
+    if (mode or "serpapi").lower() == "serpapi" and not key: return None
+    try: return backend_for(mode, key)
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+
+async def _generate_entry(rkey: str, intake: dict, backend: SearchBackend, outfits_count: int,
+                          timings: Optional[Dict[str, float]] = None, memo: Optional[Memo] = None):
+    # (entry, usage): identical concurrent misses share one generation. The usage is this
+    # caller's: what the run cost if it was ours, no calls if we joined someone else's.
+    # The entry keeps the run's memo, so every session on this answer can follow up on it
+    own: Dict[str, Any] = {}
+    memo = memo if memo is not None else Memo()
+    async def run():
+        result = await run_pipeline(intake, backend, outfits_count, timings, memo)
+        own["usage"] = result.pop("usage", None)
+        with span(backend.name, "serialize", timings):
+            return RESPONSE_CACHE.put(rkey, result, memo)
+    entry = await RESPONSE_CACHE.flight.do(rkey, run)
+    return entry, (own["usage"] if "usage" in own else _usage(backend))
+
+def _memo(entry) -> Memo:
+    # searches and links of the run behind an answer: a session opened on a cached answer, or on
+    # a run another request started, follows up without searching again
+    return entry.memo if entry is not None and entry.memo is not None else Memo()
+
+def _revalidate(rkey: str, intake: dict, backend: SearchBackend, outfits_count: int):
+    async def refresh():
+        try:
+            await ADMISSION.acquire()
+        except Saturated:
+            return  # busy: keep serving the stale copy
+        try:
+            await _generate_entry(rkey, intake, backend, outfits_count)
+        finally:
+            ADMISSION.release()
+    RESPONSE_CACHE.revalidate(rkey, refresh)
+
 @app.post("/api/generate")
-def generate(req: GenerateRequest):
-    key = (req.serpapi_api_key or "").strip() or os.getenv("SERPAPI_API_KEY", "")
-    if not key:
+async def generate(req: GenerateRequest, if_none_match: Optional[str] = Header(None)):
+    fmt = _format(req.format)
+    backend = _backend(req.mode, req.serpapi_api_key)
+    if backend is None:
         return {"outfits": [], "palette": {"colors": []}, "explanation":"Geen SERPAPI key."}
 
     intake = _to_dict(req.intake)
-    outfits = generate_with_serpapi(intake, key, req.outfits_count)
-    return outfits
+    rkey = response_key(intake, backend.name, req.outfits_count)
+    entry, state = RESPONSE_CACHE.get(rkey)
+    session = SESSIONS.open(intake, backend, req.outfits_count, _memo(entry))
+    if entry is not None:
+        # cached answers don't need a generation slot
+        if state == "stale": _revalidate(rkey, intake, backend, req.outfits_count)
+        return _cached(entry, state, if_none_match, session=session, fmt=fmt, usage=_usage(backend))
 
-def _to_dict(obj):
-    try:    return obj.model_dump()
-    except: return obj.dict()
-
-def _alloc(budget: float):
-    alloc = {
-        "outer": budget*0.25, "top1": budget*0.15, "top2": budget*0.15,
-        "bottom": budget*0.20, "shoes": budget*0.20, "tee": budget*0.04, "belt": budget*0.01
-    }
-    alloc["_total"] = round(sum(v for k,v in alloc.items() if k!="_total"), 2)
-    return alloc
-
-def _build_query(cat: str, intake: dict) -> str:
-    gender = {"male":"men","female":"women"}.get((intake.get("gender") or "unisex").lower(), "unisex")
-    styles = " ".join(intake.get("styles") or [])
-    colors = " ".join(intake.get("favorite_colors") or [])
-    terms_map = {
-        "outer":"jacket blazer overshirt coat",
-        "top1":"shirt knit sweater",
-        "top2":"shirt knit sweater",
-        "tee":"t-shirt tee",
-        "bottom":"chino trousers jeans",
-        "shoes":"sneakers shoes",
-        "belt":"belt",
-    }
-    terms = terms_map.get(cat,"clothing")
-    return " ".join(x for x in [gender, styles, terms, colors] if x).strip()
-
-def _serp_shopping(q: str, gl: str, key: str, num: int = 16):
-    r = requests.get("https://serpapi.com/search.json",
-        params={"engine":"google_shopping","q":q,"gl":gl,"hl":"nl","num":num,"api_key":key},
-        timeout=20)
-    r.raise_for_status()
-    return r.json().get("shopping_results", []) or []
-
-def _serp_product(product_id: str, gl: str, key: str):
-    r = requests.get("https://serpapi.com/search.json",
-        params={"engine":"google_shopping_product","product_id":product_id,"gl":gl,"hl":"nl","api_key":key},
-        timeout=20)
-    r.raise_for_status()
-    return r.json()
-
-def _serp_web(q: str, gl: str, key: str, num: int = 10):
-    r = requests.get("https://serpapi.com/search.json",
-        params={"engine":"google","q":q,"gl":gl,"hl":"nl","num":num,"api_key":key},
-        timeout=20)
-    r.raise_for_status()
-    return r.json().get("organic_results", []) or []
-
-def _price_of(x: dict) -> float:
-    p = x.get("extracted_price") or x.get("price") or 0
-    try: return float(p)
-    except: return 0.0
-
-def _first_url(d: dict) -> Optional[str]:
-    fields = ("link","product_link","product_page_url","product_url","source_url","redirect_link","url")
-    candidates = []
-    for k in fields:
-        v = d.get(k)
-        if isinstance(v,str) and v.strip():
-            candidates.append(v.strip())
-    if not candidates: return None
-    for u in candidates:
-        if "google.com" not in u and "shopping.google" not in u:
-            return u
-    return candidates[0]
-
-def _normalize_link(url: Optional[str], title: str="", merchant: str="") -> str:
-    if not url:
-        q = urllib.parse.quote_plus(f"{title} {merchant}".strip())
-        return f"https://www.google.com/search?q={q}"
-    u = url.strip()
-    if u.startswith("//"): u = "https:" + u
-    if not re.match(r"^https?://", u): u = "https://" + u
+    timings: Dict[str, float] = {}
+    await _admit()
     try:
-        pu = urllib.parse.urlparse(u)
-        qs = urllib.parse.parse_qs(pu.query)
-        junk = {"utm_source","utm_medium","utm_campaign","utm_content","gclid","fbclid","msclkid","aff","affid","cjevent","irclickid","irgwc","_ga","_gl"}
-        for k in list(qs.keys()):
-            if k in junk: qs.pop(k, None)
-        new_q = urllib.parse.urlencode({k:v[0] for k,v in qs.items()})
-        u = urllib.parse.urlunparse((pu.scheme,pu.netloc,pu.path,"",new_q,""))
-    except: pass
-    return u
-
-def _prefer_nl_be(link: str) -> bool:
+        with span(backend.name, "total", timings):
+            entry, usage = await _generate_entry(rkey, intake, backend, req.outfits_count, timings, session.memo)
+    finally:
+        ADMISSION.release()
+    session.memo = _memo(entry)
+    RESPONSE_CACHE.count("miss")
+    body, etag = entry.representation(fmt)
+    headers = {"ETag": etag, "X-Cache": "miss", "X-Session": session.token, "Cache-Control": "no-cache"}
+    if SERVER_TIMING:
+        headers["Server-Timing"] = server_timing(timings)
+    return Response(_with_usage(body, usage), media_type="application/json", headers=headers)
+
+@app.post("/api/generate/stream")
+async def generate_stream(req: GenerateRequest, if_none_match: Optional[str] = Header(None),
+                          accept_encoding: Optional[str] = Header(None)):
+    # NDJSON: one event per line, see pipeline.iter_generate; "done" also carries the ETag
+    fmt = _format(req.format)
+    backend = _backend(req.mode, req.serpapi_api_key)
+    if backend is None:
+        async def events():
+            yield {"event": "done", "result": {"outfits": [], "palette": {"colors": []}, "explanation":"Geen SERPAPI key."}}
+        return _stream(events(), accept_encoding)
+    intake = _to_dict(req.intake)
+    rkey = response_key(intake, backend.name, req.outfits_count)
+    entry, state = RESPONSE_CACHE.get(rkey)
+    session = SESSIONS.open(intake, backend, req.outfits_count, _memo(entry))
+    if entry is not None:
+        if state == "stale": _revalidate(rkey, intake, backend, req.outfits_count)
+        return _cached(entry, state, if_none_match, stream=True, session=session, fmt=fmt, accept_encoding=accept_encoding,
+                       usage=_usage(backend))
+    await _admit()
+    RESPONSE_CACHE.count("miss")
+    async def events():
+        async for ev in iter_generate(intake, backend, req.outfits_count, memo=session.memo):
+            if ev["event"] == "done":
+                cached = {k: v for k, v in ev["result"].items() if k != "usage"}
+                ev["etag"] = RESPONSE_CACHE.put(rkey, cached, session.memo).representation(fmt)[1]
+                ev["session"] = session.token
+                if fmt == "compact": ev["result"] = compact(ev["result"])
+            yield ev
+    return _stream(events(), accept_encoding, backend.name, headers={"X-Cache": "miss", "X-Session": session.token}, admitted=True)
+
+@app.post("/api/generate/delta")
+async def generate_delta(req: DeltaRequest, if_none_match: Optional[str] = Header(None)):
+    # Budget or outfit count changed on an earlier generation (its X-Session): same searches and
+    # links, so only allocation, pick and composition run again, without upstream calls. Newly
+    # picked items keep the link they were found with, so the answer isn't cached: a full
+    # generation of this intake still gets resolved links
+    fmt = _format(req.format)
+    session = SESSIONS.get(req.session)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sessie verlopen; genereer opnieuw.")
+    changes = {k: v for k, v in (("budget_total", req.budget_total), ("budget_per_item", req.budget_per_item)) if v is not None}
+    intake = dict(session.intake, **changes)
+    outfits_count = req.outfits_count or session.outfits_count
+    session.intake, session.outfits_count = intake, outfits_count
+    backend = session.backend
+    rkey = response_key(intake, backend.name, outfits_count)
+    entry, state = RESPONSE_CACHE.get(rkey)
+    if entry is not None:
+        return _cached(entry, state, if_none_match, session=session, fmt=fmt, usage=_usage(backend))
+
+    timings: Dict[str, float] = {}
+    await _admit()
     try:
-        host = urllib.parse.urlparse(link).netloc.lower()
-        return host.endswith(".nl") or host.endswith(".be")
-    except: return False
-
-def _resolve_direct_link(item: dict, key: str, gl: str) -> str:
-    title = item.get("title","")
-    merchant = item.get("source") or item.get("seller") or ""
-    u = _first_url(item)
-    if u and "google.com" not in u and "shopping.google" not in u:
-        return _normalize_link(u, title, merchant)
-
-    pid = item.get("product_id")
-    if not pid and u:
-        m = re.search(r"/product/(\d+)", u)
-        pid = m.group(1) if m else None
-
-    if pid:
+        with span(backend.name, "total", timings):
+            result = await run_pipeline(intake, backend, outfits_count, timings, session.memo, resolve=False)
+            usage = result.pop("usage", None)
+            with span(backend.name, "serialize", timings):
+                entry = RESPONSE_CACHE.entry(result, session.memo)
+    finally:
+        ADMISSION.release()
+    SESSIONS.counts["deltas"] += 1
+    RESPONSE_CACHE.count("miss")
+    body, etag = entry.representation(fmt)
+    headers = {"ETag": etag, "X-Cache": "miss", "X-Session": session.token, "Cache-Control": "no-cache"}
+    if SERVER_TIMING:
+        headers["Server-Timing"] = server_timing(timings)
+    return Response(_with_usage(body, usage), media_type="application/json", headers=headers)
+
+@app.post("/api/generate/batch")
+async def generate_batch(req: BatchRequest, accept_encoding: Optional[str] = Header(None)):
+    # NDJSON: one "result" line per intake as it completes (with its index), then "done"
+    fmt = _format(req.format)
+    backend = _backend(req.mode, req.serpapi_api_key)
+    if backend is None:
+        raise HTTPException(status_code=400, detail="Geen SERPAPI key.")
+    if len(req.intakes) > BATCH_MAX_INTAKES:
+        raise HTTPException(status_code=413, detail=f"Maximaal {BATCH_MAX_INTAKES} intakes per batch.")
+    intakes = [_to_dict(i) for i in req.intakes]
+    await _admit()
+    return _stream(_formatted(iter_generate_batch(intakes, backend, req.outfits_count), fmt), accept_encoding, backend.name,
+                   admitted=True)
+
+async def _formatted(events, fmt: str):
+    async for ev in events:
+        if fmt == "compact" and "result" in ev: ev = dict(ev, result=compact(ev["result"]))
+        yield ev
+
+async def _replay(entry, session=None, fmt: Optional[str] = None, usage: Optional[dict] = None):
+    # a cached result as the same event sequence a live generation produces
+    result = entry.value if usage is None else dict(entry.value, usage=usage)
+    outfits = result.get("outfits") or []
+    yield {"event": "plan", "palette": result.get("palette"), "allocation": result.get("allocation"), "outfits_count": len(outfits)}
+    for n, o in enumerate(outfits):
+        for item in o["items"]:
+            yield {"event": "item", "outfit": n, "item": item}
+    for n, o in enumerate(outfits):
+        yield {"event": "outfit", "outfit": n, "name": o["name"], "total": o["total"], "currency": o["currency"]}
+    done = {"event": "done", "result": compact(result) if fmt == "compact" else result, "etag": entry.representation(fmt)[1]}
+    if session is not None: done["session"] = session.token
+    yield done
+
+async def _ndjson(events, pipeline: str = "serpapi"):
+    async for ev in events:
+        with span(pipeline, "serialize"):
+            line = dumps(ev) + b"\n"
+        yield line
+
+async def _gzipped(chunks):
+    # one gzip stream, flushed after every event so lines still arrive as they are produced
+    z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        yield z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+    yield z.flush()
+
+class _AdmittedStream(StreamingResponse):
+    # Holds the generation slot taken before the response until the response is over, however
+    # it ends. Releasing from the body generator isn't enough: a client that goes away before
+    # the first chunk means the generator never starts, so its cleanup never runs
+    async def __call__(self, scope, receive, send):
         try:
-            data = _serp_product(pid, gl, key)
-            sellers = data.get("sellers_results") or []
-            if merchant:
-                m0 = merchant.lower().split()[0]
-                for s in sellers:
-                    link = s.get("link") or ""
-                    store = (s.get("source") or s.get("seller") or s.get("store") or "").lower()
-                    if m0 and (m0 in store or m0 in link.lower()):
-                        if link and "google.com" not in link:
-                            return _normalize_link(link, title, store or merchant)
-            best = None
-            for s in sellers:
-                link = s.get("link")
-                if link and "google.com" not in link:
-                    if _prefer_nl_be(link): return _normalize_link(link, title, merchant)
-                    best = best or link
-            if best: return _normalize_link(best, title, merchant)
-        except: pass
-
-    organics = _serp_web(f"{title} {merchant}".strip(), gl, key, num=10)
-    kw = re.sub(r"[^a-z0-9]+","",(merchant or "").lower())
-    for r in organics:
-        link = r.get("link")
-        if not isinstance(link,str): continue
-        if "google.com" in link: continue
-        host = urllib.parse.urlparse(link).netloc.lower().replace("www.","")
-        host_flat = re.sub(r"[^a-z0-9]+","",host)
-        if kw and kw in host_flat:
-            return _normalize_link(link, title, merchant)
-    for r in organics:
-        link = r.get("link")
-        if isinstance(link,str) and link.strip() and "google.com" not in link and _prefer_nl_be(link):
-            return _normalize_link(link, title, merchant)
-    for r in organics:
-        link = r.get("link")
-        if isinstance(link,str) and link.strip() and "google.com" not in link:
-            return _normalize_link(link, title, merchant)
-
-    return _normalize_link(None, title, merchant)
-
-def _map(cat: str, item: dict, link: str):
-    price = _price_of(item)
-    cur = item.get("currency") or "EUR"
-    return {
-        "category": cat,
-        "title": item.get("title","—"),
-        "price": round(price,2),
-        "currency": cur,
-        "link": link,
-        "image": item.get("thumbnail"),
-        "merchant": item.get("source") or item.get("seller") or "",
-    }
+            await super().__call__(scope, receive, send)
+        finally:
+            ADMISSION.release()
 
-def _pick(results: list, max_price: float):
-    cands = [r for r in results if _price_of(r) > 0]
-    within = [r for r in cands if _price_of(r) <= max_price * 1.10]
-    pool = within or cands
-    if not pool: return None
-    pool.sort(key=lambda r: abs(_price_of(r) - max_price))
-    return pool[0]
-
-def generate_with_serpapi(intake: dict, key: str, outfits_count: int = 3):
-    budget = float(intake.get("budget_total") or 250.0)
-    alloc = _alloc(budget)
-    gl = (intake.get("country") or "NL")[:2].lower()
-    palette = {"colors": (intake.get("favorite_colors") or ["navy","wit","grijs","zwart"])}
-
-    categories = ["outer","top1","top2","bottom","shoes","tee","belt"]
-    outfits = []
-    cache: Dict[str, list] = {}
-
-    for n in range(outfits_count or 3):
-        items, total = [], 0.0
-        for cat in categories:
-            q = _build_query(cat, intake)
-            if q not in cache:
-                cache[q] = _serp_shopping(q, gl, key, num=16)
-            found = _pick(cache[q], alloc[cat])
-            if found:
-                direct = _resolve_direct_link(found, key, gl)
-                mapped = _map(cat, found, direct)
-                if _is_direct_product_url(mapped["link"]):
-                    items.append(mapped); total += mapped["price"]
-        outfits.append({
-            "name": f"Outfit {n+1}",
-            "items": items,
-            "total": round(total,2),
-            "currency": "EUR"
-        })
-
-    explanation = "Selectie live gezocht in NL/BE shops; links leiden rechtstreeks naar productpagina’s (prijs/maat/bestellen aanwezig)."
-    return {
-        "palette": palette,
-        "allocation": alloc,
-        "outfits": outfits,
-        "explanation": explanation,
-        "independent_note": "Onpartijdig: geen affiliate.",
-        "country": intake.get("country") or "NL",
-        "currency": "EUR",
-    }
+def _stream(events, accept_encoding: Optional[str], pipeline: str = "serpapi", headers: Optional[Dict[str, str]] = None,
+            admitted: bool = False):
+    # admitted: the caller holds an ADMISSION slot that the response gives back
+    headers = dict(headers or {})
+    body = _ndjson(events, pipeline)
+    if "gzip" in (accept_encoding or ""):
+        body = _gzipped(body)
+        headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    return (_AdmittedStream if admitted else StreamingResponse)(body, media_type="application/x-ndjson", headers=headers)
+
+def _to_dict(obj):
+    try:    return obj.model_dump()
+    except: return obj.dict()
 
-def _is_direct_product_url(url: str) -> bool:
+async def _batch_cli(path: str, mode: str, outfits_count: int, fmt: str, out):
+    # intakes as JSONL or a JSON list; same validation and defaults as the API
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    rows = json.loads(text) if text.lstrip().startswith("[") else [json.loads(l) for l in text.splitlines() if l.strip()]
+    try: backend = backend_for(mode, os.getenv("SERPAPI_API_KEY", ""))
+    except ValueError as e: raise SystemExit(str(e))
     try:
-        u = urllib.parse.urlparse(url)
-        host = u.netloc.lower()
-        if any(b in host for b in ["google.com","shopping.google","googleadservices","doubleclick"]): return False
-        segs = [s for s in u.path.split("/") if s]
-        return len(segs) >= 1
-    except:
-        return False
+        events = _formatted(iter_generate_batch([_to_dict(Intake(**r)) for r in rows], backend, outfits_count), fmt)
+        async for line in _ndjson(events, backend.name):
+            out.write(line.decode("utf-8"))
+            out.flush()
+    finally:
+        await ASYNC_SERP_CLIENT.aclose()
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000)
+    import argparse, getpass, sys, tempfile
+    ap = argparse.ArgumentParser(description="Anna API server (development); `serve` for production with several workers, "
+                                             "or `batch` to generate for a file of intakes.")
+    sub = ap.add_subparsers(dest="cmd")
+    sv = sub.add_parser("serve", help="N worker processes sharing the SerpAPI cache, link index, quota and thumbnails")
+    sv.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    sv.add_argument("--host", default="0.0.0.0")
+    sv.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    sv.add_argument("--state-dir", default=os.getenv("ANNA_STATE_DIR") or os.path.join(tempfile.gettempdir(), f"anna-state-{getpass.getuser()}"),
+                    help="SQLite files the workers share (ANNA_STATE_DIR)")
+    b = sub.add_parser("batch", help="intakes (JSONL or JSON list) in, NDJSON results out")
+    b.add_argument("intakes")
+    b.add_argument("--mode", choices=BACKENDS, default="serpapi", help="fixture reads ANNA_FIXTURE")
+    b.add_argument("--outfits", type=int, default=3)
+    b.add_argument("--format", choices=FORMATS, default="full")
+    b.add_argument("--out", help="write here instead of stdout")
+    a = ap.parse_args()
+    if a.cmd == "batch":
+        with (open(a.out, "w", encoding="utf-8") if a.out else sys.stdout) as out:
+            asyncio.run(_batch_cli(a.intakes, a.mode, a.outfits, a.format, out))
+    elif a.cmd == "serve":
+        # the modules above read ANNA_STATE_DIR when imported, and with one worker uvicorn serves
+        # from this process: start over with it in the environment, which the workers inherit too
+        state_dir = private_dir(os.path.abspath(a.state_dir))
+        if STATE_DIR != state_dir:
+            os.environ["ANNA_STATE_DIR"] = state_dir
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        import uvicorn
+        uvicorn.run("main:app", host=a.host, port=a.port, workers=a.workers)
+    else:
+        import uvicorn
+        uvicorn.run("main:app", host="0.0.0.0", port=8000)
@@ -0,0 +1,99 @@
+import os, time, bisect, threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# In-process metrics in Prometheus text format; no client library needed for a
+# handful of histograms and counters. One observe is a bisect plus two adds.
+
+SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "0") == "1"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0)
+
+_REGISTRY: List["_Metric"] = []
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *values: str, n: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + n
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return super().render() + [f"{self.name}{_labels(self.labels, k)} {v:g}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, seconds: float, *values: str):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            s = self._series.get(values)
+            if s is None:
+                s = self._series[values] = [0] * (len(self.buckets) + 2)
+            s[i] += 1
+            s[-1] += seconds
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        out = super().render()
+        for key, s in series:
+            acc = 0
+            for le, n in zip((*self.buckets, "+Inf"), s[:-1]):
+                acc += n
+                le_label = f'le="{le}"'
+                out.append(f"{self.name}_bucket{_labels(self.labels, key, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labels, key)} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labels, key)} {acc}")
+        return out
+
+STAGE_SECONDS = Histogram("anna_stage_seconds", "Wall time per generation stage", ("pipeline", "stage"))
+UPSTREAM_SECONDS = Histogram("anna_upstream_seconds", "SerpAPI HTTP call duration, per attempt", ("engine",))
+UPSTREAM_CALLS = Counter("anna_upstream_calls_total", "SerpAPI HTTP attempts by outcome", ("engine", "outcome"))
+CACHE_LOOKUPS = Counter("anna_serp_cache_lookups_total", "SerpAPI cache lookups", ("engine", "result"))
+SWALLOWED = Counter("anna_swallowed_errors_total", "Errors caught and ignored on the request path", ("site",))
+
+@contextmanager
+def span(pipeline: str, stage: str, timings: Optional[Dict[str, float]] = None):
+    # Times the block into STAGE_SECONDS; with `timings`, also adds to that request's
+    # per-stage totals (for Server-Timing)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_SECONDS.observe(dt, pipeline, stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + dt
+
+def server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in timings.items())
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _REGISTRY:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,88 @@
+from typing import Any, Dict, List, Sequence, Tuple
+
+# Outfit-level selection: instead of taking each category's closest-to-share item on
+# its own, beam-search over bounded per-category candidate lists for the outfits that
+# best fill the total budget, then pick the top-K that differ enough from each other.
+
+Candidate = Tuple[float, Any]  # (price, item)
+
+def _fit(price: float, target: float) -> float:
+    # 1.0 on the category's budget share, falling off linearly to 0 at ±100%
+    if target <= 0: return 0.0
+    return max(0.0, 1.0 - abs(price - target) / target)
+
+def _trim(cands: Sequence[Candidate], target: float, limit: int, margin: float) -> List[Candidate]:
+    # items within the per-item margin of their share if there are any (beslisregel ±10%),
+    # then the `limit` nearest the share, plus the cheapest so a fit stays possible
+    cands = [c for c in cands if c[0] > 0]
+    cands = [c for c in cands if c[0] <= target * margin] or cands
+    if len(cands) <= limit: return list(cands)
+    near = sorted(range(len(cands)), key=lambda i: (abs(cands[i][0] - target), i))[:limit]
+    cheapest = min(range(len(cands)), key=lambda i: (cands[i][0], i))
+    if cheapest not in near: near[-1] = cheapest
+    return [cands[i] for i in sorted(near)]
+
+def best_outfits(candidates: Dict[str, Sequence[Candidate]], targets: Dict[str, float], budget: float,
+                 k: int = 3, min_diff: int = 2, beam: int = 32, max_candidates: int = 10,
+                 fit_weight: float = 0.5, item_margin: float = 1.1) -> List[Dict[str, Candidate]]:
+    # Top-k outfits (category -> (price, item)) under `budget`, scored as
+    #   fit_weight * mean item fit to its category share + (1 - fit_weight) * total / budget
+    # Outfits differ in at least `min_diff` items where the pool allows (relaxed step by
+    # step otherwise); an outfit repeats an item only if a category has no other choice.
+    # Empty categories are left out.
+    cats = [c for c in candidates if any(p > 0 for p, _ in candidates[c])]
+    if not cats or budget <= 0: return []
+    pools = {c: _trim(candidates[c], targets.get(c, 0.0), max_candidates, item_margin) for c in cats}
+    n = len(cats)
+    # cheapest possible spend on the categories still to come, for pruning
+    min_rest = [0.0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        min_rest[i] = min_rest[i + 1] + min(p for p, _ in pools[cats[i]])
+    max_rest = [0.0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        max_rest[i] = max_rest[i + 1] + max(p for p, _ in pools[cats[i]])
+    if min_rest[0] > budget:
+        # nothing fits: cheapest of everything is the least-bad outfit
+        cheapest = {c: min(pools[c], key=lambda x: x[0]) for c in cats}
+        return [dict(cheapest) for _ in range(max(1, k))]
+
+    def bound(fit_sum: float, total: float, depth: int) -> float:
+        util = min(1.0, (total + max_rest[depth]) / budget)
+        return fit_weight * (fit_sum + n - depth) / n + (1 - fit_weight) * util
+
+    states: List[Tuple[float, float, Tuple[int, ...]]] = [(0.0, 0.0, ())]  # (fit_sum, total, choice idx)
+    for depth, cat in enumerate(cats):
+        target, pool = targets.get(cat, 0.0), pools[cat]
+        nxt = []
+        for distinct in (True, False):
+            for fit_sum, total, picks in states:
+                used = [pools[cats[d]][i][1] for d, i in enumerate(picks)] if distinct else ()
+                for idx, (price, item) in enumerate(pool):
+                    t = total + price
+                    if t + min_rest[depth + 1] > budget: continue
+                    if any(item is u for u in used): continue  # e.g. top1/top2 share one result list
+                    nxt.append((fit_sum + _fit(price, target), t, picks + (idx,)))
+            if nxt: break  # only repeat an item when the pool leaves no other choice
+        # wider final layer so the diversity pass has enough distinct outfits to choose from
+        width = beam * max(1, k) if depth == n - 1 else beam
+        nxt.sort(key=lambda s: (-bound(s[0], s[1], depth + 1), s[2]))
+        states = nxt[:width]
+
+    ranked = sorted(states, key=lambda s: (-(fit_weight * s[0] / n + (1 - fit_weight) * s[1] / budget), s[2]))
+    # diversity on the items themselves, so swapping top1/top2 doesn't count as a new outfit
+    item_ids = lambda picks: {id(pools[c][i][1]) for c, i in zip(cats, picks)}
+    chosen: List[Tuple[int, ...]] = []
+    chosen_ids: List[set] = []
+    for need in range(min(min_diff, n), -1, -1):
+        for _, _, picks in ranked:
+            if len(chosen) >= k: break
+            if picks in chosen: continue
+            ids = item_ids(picks)
+            if all(len(ids - other) >= need for other in chosen_ids):
+                chosen.append(picks)
+                chosen_ids.append(ids)
+        if len(chosen) >= k: break
+    found = len(chosen)
+    while chosen and len(chosen) < k:
+        chosen.append(chosen[len(chosen) % found])  # pool too thin: repeat rather than drop outfits
+    return [{cat: pools[cat][i] for cat, i in zip(cats, picks)} for picks in chosen]
@@ -0,0 +1,33 @@
+from typing import Any, Dict, List
+
+import orjson
+
+# Response bodies: orjson for serialization, and an optional compact form of a result
+# (format="compact") in which every distinct item appears once in `items` and outfits
+# refer to it by index. The full form stays the default for existing clients.
+FORMATS = ("full", "compact")
+
+def dumps(value: Any) -> bytes:
+    # same bytes as json.dumps(..., ensure_ascii=False, separators=(",", ":")), several times faster
+    return orjson.dumps(value)
+
+def compact(result: Dict[str, Any]) -> Dict[str, Any]:
+    # Item fields equal to the result's currency, empty merchants and missing images are left out;
+    # the client fills them back in (frontend/app.js: expand)
+    if not result or "outfits" not in result: return result
+    cur = result.get("currency") or "EUR"
+    index: Dict[bytes, int] = {}
+    items: List[dict] = []
+    outfits = []
+    for o in result["outfits"]:
+        refs = []
+        for it in o["items"]:
+            k = dumps(it)  # items carry a nested cheaper_alternative, so not a tuple of values
+            if k not in index:
+                index[k] = len(items)
+                items.append({f: v for f, v in it.items() if v not in (None, "") and not (f == "currency" and v == cur)})
+            refs.append(index[k])
+        out = {"name": o["name"], "items": refs, "total": o["total"]}
+        if o.get("currency") != cur: out["currency"] = o.get("currency")
+        outfits.append(out)
+    return dict(result, format="compact", items=items, outfits=outfits)
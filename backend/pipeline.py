@@ -0,0 +1,310 @@
+import os, asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from catalog import parse_price
+from metrics import SWALLOWED, span
+from optimizer import best_outfits
+from outfit_engine import _derive_currency
+from response_cache import RESPONSE_CACHE, response_key
+from search_backends import SearchBackend, item_key
+from thumbs import THUMBS
+
+# One generation pipeline for every mode: plan -> search -> pick -> resolve -> compose.
+# Searching and resolving links are up to the SearchBackend (search_backends.py).
+
+# Max parallel lookups per request and overall wall-clock cap on the search stage
+SEARCH_CONCURRENCY = int(os.getenv("SERP_SEARCH_CONCURRENCY", "7"))
+SEARCH_DEADLINE = float(os.getenv("SERP_SEARCH_DEADLINE", "25"))
+RESOLVE_DEADLINE = float(os.getenv("SERP_RESOLVE_DEADLINE", "25"))
+# Batch runs: wider fan-out and a longer deadline per stage
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+BATCH_DEADLINE = float(os.getenv("BATCH_DEADLINE", "300"))
+
+CATEGORIES = ["outer","top1","top2","bottom","shoes","tee","belt"]
+
+def _alloc(budget: float):
+    alloc = {
+        "outer": budget*0.25, "top1": budget*0.15, "top2": budget*0.15,
+        "bottom": budget*0.20, "shoes": budget*0.20, "tee": budget*0.04, "belt": budget*0.01
+    }
+    alloc["_total"] = round(sum(v for k,v in alloc.items() if k!="_total"), 2)
+    return alloc
+
+def _price_of(x: dict) -> float:
+    p = parse_price(x.get("extracted_price") or x.get("price") or 0)
+    if p is None:
+        SWALLOWED.inc("price_parse")
+        return 0.0
+    return p
+
+def _cheaper(cands: list, cap: float, best: dict, best_price: float) -> Optional[dict]:
+    # cheaper alternative at ~85% of the pick's price: the cheapest other candidate below that,
+    # among those within +10% of the category's share (all of them if none is)
+    within = [c for c in cands if 0 < c[0] <= cap * 1.1] or [c for c in cands if c[0] > 0]
+    alts = [c for c in within if c[0] <= best_price * 0.85 and c[1] != best]
+    return min(alts, key=lambda c: c[0])[1] if alts else None
+
+def _alternative(item: Optional[dict], currency: str) -> Optional[dict]:
+    # shown next to the pick as found; its link isn't resolved, that would cost a lookup per item
+    if item is None: return None
+    return {
+        "title": item.get("title","—"),
+        "price": round(_price_of(item),2),
+        "currency": item.get("currency") or currency,
+        "link": item.get("link") or item.get("product_link"),
+        "merchant": item.get("source") or item.get("seller") or "",
+    }
+
+def _map(cat: str, item: dict, link: str, currency: str = "EUR", cheaper: Optional[dict] = None):
+    price = _price_of(item)
+    cur = item.get("currency") or currency
+    return {
+        "category": cat,
+        "title": item.get("title","—"),
+        "price": round(price,2),
+        "currency": cur,
+        "link": link,
+        "image": THUMBS.url_for(item.get("thumbnail")),
+        "merchant": item.get("source") or item.get("seller") or "",
+        "cheaper_alternative": _alternative(cheaper, currency),
+    }
+
+async def iter_parallel(calls: Dict[Any, tuple], timeout: float = SEARCH_DEADLINE, concurrency: int = SEARCH_CONCURRENCY):
+    # calls: {key: (async fn, *args)}; yields (key, result) in completion order, None on failure.
+    # At most `concurrency` run at once; whatever is still pending at `timeout` is cancelled.
+    if not calls: return
+    sem = asyncio.Semaphore(concurrency)
+    async def run(k, fn, *args):
+        async with sem:
+            try: return k, await fn(*args)
+            except Exception:
+                SWALLOWED.inc("parallel_call")
+                return k, None
+    tasks = [asyncio.ensure_future(run(k, *c)) for k, c in calls.items()]
+    try:
+        for fut in asyncio.as_completed(tasks, timeout=timeout):
+            try: yield await fut
+            except asyncio.TimeoutError: return
+    finally:
+        for t in tasks: t.cancel()
+
+async def run_parallel(calls: Dict[Any, tuple], timeout: float = SEARCH_DEADLINE,
+                       concurrency: int = SEARCH_CONCURRENCY) -> Dict[Any, Any]:
+    # late calls map to None as well
+    out: Dict[Any, Any] = {k: None for k in calls}
+    async for k, v in iter_parallel(calls, timeout, concurrency):
+        out[k] = v
+    return out
+
+class Memo:
+    # Search results per query and resolved links per item from earlier runs for one intake.
+    # Neither depends on the budget or the outfit count, so a re-run that only changes those
+    # (sessions.py) goes straight to pick and compose.
+    def __init__(self):
+        self.found: Dict[Any, list] = {}
+        self.links: Dict[str, str] = {}
+
+# --- Stages -------------------------------------------------------------------
+
+def _plan(intake: dict, backend: SearchBackend, outfits_count: int) -> dict:
+    per_item = intake.get("budget_per_item") or 0
+    budget = float(intake.get("budget_total") or per_item * len(CATEGORIES) or 250.0)
+    country = intake.get("country") or "NL"
+    return {
+        "budget": budget,
+        "alloc": _alloc(budget),
+        "currency": _derive_currency(country, intake.get("currency")),
+        "gl": country[:2].lower(),
+        "palette": backend.palette(intake),
+        "n_outfits": outfits_count or 3,
+    }
+
+def _pooled(queries: tuple, results: Dict[Any, list]) -> list:
+    # one query: its results as-is; variants: pooled, the same product listed once
+    if len(queries) == 1: return results.get(queries[0]) or []
+    out, seen = [], set()
+    for q in queries:
+        for r in results.get(q) or []:
+            k = (r.get("link"), r.get("title"))
+            if k not in seen:
+                seen.add(k)
+                out.append(r)
+    return out
+
+def _select(plan: dict, queries: Dict[str, tuple], results: Dict[Any, list]) -> Tuple[Dict[tuple, dict], Dict[tuple, dict]]:
+    # Whole-outfit selection against the total budget, distinct outfits where the results allow;
+    # (picks, cheaper alternatives), both keyed on (outfit, category)
+    cands = {cat: [(_price_of(r), r) for r in _pooled(queries[cat], results)] for cat in CATEGORIES}
+    picks: Dict[tuple, dict] = {}
+    cheaper: Dict[tuple, dict] = {}
+    for n, chosen in enumerate(best_outfits(cands, plan["alloc"], plan["budget"], k=plan["n_outfits"])):
+        for cat, (price, found) in chosen.items():
+            picks[(n, cat)] = found
+            alt = _cheaper(cands[cat], plan["alloc"][cat], found, price)
+            if alt is not None: cheaper[(n, cat)] = alt
+    return picks, cheaper
+
+def _outfits(plan: dict, mapped: Dict[tuple, dict]) -> List[dict]:
+    outfits = []
+    for n in range(plan["n_outfits"]):
+        items = [mapped[(n, cat)] for cat in CATEGORIES if (n, cat) in mapped]
+        outfits.append({
+            "name": f"Outfit {n+1}",
+            "items": items,
+            "total": round(sum(i["price"] for i in items),2),
+            "currency": plan["currency"]
+        })
+    return outfits
+
+def _result(backend: SearchBackend, intake: dict, plan: dict, outfits: List[dict]) -> dict:
+    return {
+        "palette": plan["palette"],
+        "allocation": plan["alloc"],
+        "outfits": outfits,
+        "explanation": backend.explain(intake, plan),
+        "independent_note": backend.independent_note,
+        "country": intake.get("country") or "NL",
+        "currency": plan["currency"],
+    }
+
+async def _search_all(backend: SearchBackend, queries: Dict[str, tuple], gl: str, usage, memo: Optional[Memo] = None) -> Dict[Any, list]:
+    unique = {q for qs in queries.values() for q in qs}
+    known = memo.found if memo is not None else {}
+    res = await run_parallel({q: (backend.search, q, gl, usage) for q in unique if q not in known})
+    if memo is not None:
+        # failed or empty searches are tried again next time
+        memo.found.update((q, v) for q, v in res.items() if v)
+    return {q: (known.get(q) or res.get(q) or []) for q in unique}
+
+async def iter_generate(intake: dict, backend: SearchBackend, outfits_count: int = 3, timings: Optional[Dict[str, float]] = None,
+                        memo: Optional[Memo] = None, resolve: bool = True):
+    # Yields plan -> item (as links resolve) -> outfit -> done; "done" carries the full payload.
+    # With a memo, searches and links it already has are reused and new ones are added to it.
+    # resolve=False (deltas): picks without a known link keep the one they were found with,
+    # so nothing goes upstream; those links aren't added to the memo.
+    name = backend.name
+    plan = _plan(intake, backend, outfits_count)
+    gl = plan["gl"]
+    usage = backend.usage()
+    yield {"event": "plan", "palette": plan["palette"], "allocation": plan["alloc"], "outfits_count": plan["n_outfits"]}
+
+    with span(name, "query", timings):
+        queries = {cat: backend.queries(cat, intake, plan) for cat in CATEGORIES}
+    with span(name, "search", timings):
+        found = await _search_all(backend, queries, gl, usage, memo)
+    with span(name, "pick", timings):
+        picks, cheaper = _select(plan, queries, found)
+
+    # Resolve each distinct picked item once; every outfit slot using it shares the link
+    slots: Dict[str, list] = {}
+    unique: Dict[str, dict] = {}
+    for slot, item in picks.items():
+        k = item_key(item)
+        unique.setdefault(k, item)
+        slots.setdefault(k, []).append(slot)
+    mapped: Dict[tuple, dict] = {}
+    links = memo.links if memo is not None else {}
+    new = {k: it for k, it in unique.items() if k not in links}
+    resolved = iter_parallel({k: (backend.resolve, it, gl, usage) for k, it in new.items()} if resolve else {}, timeout=RESOLVE_DEADLINE)
+    async def known():
+        for k in unique:
+            if k in links: yield k, links[k]
+            elif not resolve: yield k, backend.found_link(new[k])
+        async for k, link in resolved:
+            if link is not None and memo is not None: links[k] = link
+            yield k, link
+    # "resolve" runs until the last link is in; for the stream it includes the time spent writing events
+    with span(name, "resolve", timings):
+        async for k, link in known():
+            if link is None: continue
+            events = []
+            with span(name, "map", timings):
+                for n, cat in slots[k]:
+                    m = _map(cat, picks[(n, cat)], link, plan["currency"], cheaper.get((n, cat)))
+                    mapped[(n, cat)] = m
+                    events.append({"event": "item", "outfit": n, "item": m})
+            for ev in events:
+                yield ev
+
+    outfits = _outfits(plan, mapped)
+    for n, outfit in enumerate(outfits):
+        yield {"event": "outfit", "outfit": n, "name": outfit["name"], "total": outfit["total"], "currency": outfit["currency"]}
+    result = _result(backend, intake, plan, outfits)
+    if usage is not None: result["usage"] = usage.report()
+    yield {"event": "done", "result": result}
+
+async def generate(intake: dict, backend: SearchBackend, outfits_count: int = 3, timings: Optional[Dict[str, float]] = None,
+                   memo: Optional[Memo] = None, resolve: bool = True):
+    result = None
+    async for ev in iter_generate(intake, backend, outfits_count, timings, memo, resolve):
+        if ev["event"] == "done":
+            result = ev["result"]
+    return result
+
+async def iter_generate_batch(intakes: List[dict], backend: SearchBackend, outfits_count: int = 3):
+    # Many intakes in one pass: every distinct (query, country) is searched once and every
+    # distinct picked item resolved once across the whole batch, so the cost follows the
+    # number of distinct queries rather than intakes x categories. Yields
+    # {"event": "result", "index": i, "result": ...} per intake in completion order, then "done".
+    usage = backend.usage(len(intakes))
+    jobs: Dict[str, dict] = {}  # response key -> plan for that intake, shared by duplicates
+    cached = 0
+    for i, intake in enumerate(intakes):
+        rkey = response_key(intake, backend.name, outfits_count)
+        if rkey in jobs:
+            jobs[rkey]["indexes"].append(i)
+            continue
+        entry, _ = RESPONSE_CACHE.get(rkey)
+        if entry is not None:
+            cached += 1
+            yield {"event": "result", "index": i, "result": entry.value, "cached": True}
+            continue
+        plan = _plan(intake, backend, outfits_count)
+        plan.update(intake=intake, indexes=[i], queries={cat: backend.queries(cat, intake, plan) for cat in CATEGORIES})
+        jobs[rkey] = plan
+
+    searches = {(q, p["gl"]) for p in jobs.values() for qs in p["queries"].values() for q in qs}
+    found = await run_parallel({s: (backend.search, s[0], s[1], usage) for s in searches},
+                               timeout=BATCH_DEADLINE, concurrency=BATCH_CONCURRENCY)
+
+    unique: Dict[tuple, dict] = {}   # (gl, item key) -> item
+    slots: Dict[tuple, list] = {}    # (gl, item key) -> [(response key, outfit, category)]
+    pending: Dict[str, set] = {}     # response key -> item keys still resolving
+    for rkey, p in jobs.items():
+        p["picks"], p["cheaper"] = _select(p, p["queries"], {q: found.get((q, p["gl"])) or [] for qs in p["queries"].values() for q in qs})
+        p["mapped"] = {}
+        pending[rkey] = set()
+        for (n, cat), item in p["picks"].items():
+            k = (p["gl"], item_key(item))
+            unique.setdefault(k, item)
+            slots.setdefault(k, []).append((rkey, n, cat))
+            pending[rkey].add(k)
+
+    def finish(rkey: str):
+        p = jobs[rkey]
+        result = _result(backend, p["intake"], p, _outfits(p, p["mapped"]))
+        RESPONSE_CACHE.put(rkey, result)
+        return [{"event": "result", "index": i, "result": result} for i in p["indexes"]]
+
+    for rkey in [r for r, ks in pending.items() if not ks]:
+        del pending[rkey]
+        for ev in finish(rkey): yield ev
+    calls = {k: (backend.resolve, item, k[0], usage) for k, item in unique.items()}
+    async for k, link in iter_parallel(calls, timeout=BATCH_DEADLINE, concurrency=BATCH_CONCURRENCY):
+        if link is not None:
+            for rkey, n, cat in slots[k]:
+                p = jobs[rkey]
+                p["mapped"][(n, cat)] = _map(cat, p["picks"][(n, cat)], link, p["currency"], p["cheaper"].get((n, cat)))
+        for rkey in {r for r, _, _ in slots[k]}:
+            ks = pending[rkey]
+            ks.discard(k)
+            if not ks:
+                del pending[rkey]
+                for ev in finish(rkey): yield ev
+    # past the deadline: send what we have
+    for rkey in list(pending):
+        for ev in finish(rkey): yield ev
+    done = {"event": "done", "intakes": len(intakes), "cached": cached, "generated": len(jobs),
+            "searches": len(searches), "items": len(unique)}
+    if usage is not None: done["usage"] = usage.report()
+    yield done
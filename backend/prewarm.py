@@ -0,0 +1,93 @@
+import os, asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from metrics import Counter
+from quota import QUOTA
+from serp_cache import SERP_CACHE, SerpCache
+
+# Background refresh of popular SerpAPI lookups (shopping searches, and the product
+# and web lookups behind link resolution) shortly before their cache entries expire,
+# so the next user finds them warm. Spends at most CALLS_PER_HOUR searches; 0 = off.
+CALLS_PER_HOUR = float(os.getenv("PREWARM_CALLS_PER_HOUR", "0"))
+INTERVAL = float(os.getenv("PREWARM_INTERVAL", "60"))
+HORIZON = float(os.getenv("PREWARM_HORIZON", "900"))       # refresh entries expiring within this many seconds
+MIN_SCORE = float(os.getenv("PREWARM_MIN_SCORE", "3"))     # decayed hit count, see serp_cache.POPULARITY_HALF_LIFE
+CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "4"))
+
+PREWARM_CALLS = Counter("anna_prewarm_total", "Background cache refreshes", ("engine", "outcome"))
+
+class Prewarmer:
+    def __init__(self, cache: SerpCache = SERP_CACHE, calls_per_hour: float = CALLS_PER_HOUR, interval: float = INTERVAL,
+                 horizon: float = HORIZON, min_score: float = MIN_SCORE, concurrency: int = CONCURRENCY):
+        self.cache = cache
+        self.interval = interval
+        self.horizon = horizon
+        self.min_score = min_score
+        self.concurrency = concurrency
+        self.calls_per_hour = calls_per_hour
+        # burst of one interval's share, so a backlog can't spend the hour at once; one budget
+        # for all workers when the quota is shared
+        self.bucket = QUOTA.bucket("prewarm", calls_per_hour / 3600.0, max(1.0, calls_per_hour * interval / 3600.0))
+        self.counts = {"rounds": 0, "refreshed": 0, "errors": 0, "over_budget": 0}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, key: str, refresh: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        # refresh(params) fetches upstream and stores the result in the cache
+        if self.calls_per_hour <= 0 or not key or self._task is not None: return
+        self._task = asyncio.ensure_future(self._loop(key, refresh))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    async def _loop(self, key: str, refresh):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once(key, refresh)
+            except Exception:
+                self.counts["errors"] += 1
+
+    async def run_once(self, key: str, refresh) -> int:
+        self.counts["rounds"] += 1
+        # the cache and the budgets may be SQLite shared with other workers: off the event loop
+        todo = await asyncio.to_thread(self._due, key)
+        sem = asyncio.Semaphore(self.concurrency)
+        async def one(params):
+            engine = params.get("engine", "")
+            async with sem:
+                try:
+                    await refresh(dict(params, api_key=key))
+                except Exception:
+                    self.counts["errors"] += 1
+                    PREWARM_CALLS.inc(engine, "error")
+                    return
+            self.counts["refreshed"] += 1
+            PREWARM_CALLS.inc(engine, "ok")
+        await asyncio.gather(*[one(p) for p in todo])
+        return len(todo)
+
+    def _due(self, key: str) -> List[Dict[str, Any]]:
+        due = self.cache.expiring(self.horizon, self.min_score, limit=int(self.bucket.capacity) + 1)
+        todo: List[Dict[str, Any]] = []
+        for _, params in due:
+            # both our own budget and the key's plan quota have to allow it
+            if not self.bucket.take():
+                self.counts["over_budget"] += len(due) - len(todo)
+                break
+            if not QUOTA.take(key):
+                self.counts["over_budget"] += len(due) - len(todo)
+                break
+            todo.append(params)
+        return todo
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counts, enabled=self._task is not None, calls_per_hour=self.calls_per_hour,
+                    horizon=self.horizon, min_score=self.min_score,
+                    popular=[{"score": s, "engine": p.get("engine"), "q": p.get("q") or p.get("product_id")}
+                             for s, p in self.cache.popular(5)])
+
+PREWARMER = Prewarmer()
@@ -0,0 +1,118 @@
+import json, random, hashlib, itertools
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from style_presets import COUNTRY_SHOPS, STYLE_KEYWORDS
+
+# Query compilation. Everything a search query is made of except the per-category
+# keyword/color draw is fixed per country and per intake signature, so it's built
+# once here instead of on every request.
+
+# Per category base keywords
+BASE_TERMS = {
+    "outer": ["overshirt", "light jacket", "blazer", "shacket"],
+    "top1": ["oxford shirt", "knit sweater", "merino sweater", "blouse"],
+    "top2": ["shirt", "crewneck", "henley", "blouse"],
+    "bottom": ["chino", "trousers", "jeans"],
+    "shoes": ["sneakers", "derby", "loafers"],
+    "tee": ["heavy cotton t-shirt", "white tee"],
+    "accessory": ["leather belt", "scarf", "beanie"]
+}
+
+# Style modifiers
+STYLE_MOD = {
+    "minimalistisch": {"outer": ["unstructured", "clean"], "bottom": ["tapered"], "shoes": ["minimal"]},
+    "casual": {"outer": ["overshirt"], "bottom": ["jeans", "chino"], "shoes": ["sneakers"]},
+    "klassiek": {"outer": ["blazer"], "bottom": ["chino"], "shoes": ["derby", "loafer"]},
+    "sportief": {"outer": ["track jacket"], "bottom": ["joggers"], "shoes": ["trainers", "running"]},
+    "creatief": {"outer": ["pattern"], "accessory": ["accent color"]}
+}
+
+# Accessibility filters: (intake flags, any of which adds the words)
+ACCESSIBILITY_WORDS = (
+    (("easy_closures",), ["magnetic", "snap", "easy closure"]),
+    (("elastic_waist", "pull_on"), ["elastic waist", "pull-on"]),
+    (("soft_fabrics",), ["soft", "brushed", "stretch"]),
+)
+
+# Gender nuance
+GENDER_TERMS = {
+    "male": ["men", "heren"],
+    "female": ["women", "dames"],
+    "unisex": ["unisex"],
+    "non-binary": ["unisex"]
+}
+
+# Countries → shops, as the site filter every query for that country ends with
+SITE_FILTERS = {country: " OR ".join(f"site:{d}" for d in shops) for country, shops in COUNTRY_SHOPS.items()}
+
+Signature = Tuple[str, str, Tuple[str, ...], str, Tuple[bool, ...], Tuple[str, ...]]
+
+def signature(intake: Dict[str, Any], styles: List[str], colors: List[str]) -> Signature:
+    # everything _build_queries output depends on, normalized; equal intakes give equal signatures
+    acc = intake.get("accessibility") or {}
+    return (
+        intake["country"].upper(),
+        intake["gender"].lower(),
+        tuple(styles),
+        (intake.get("fit") or "").lower(),
+        tuple(any(acc.get(f) for f in flags) for flags, _ in ACCESSIBILITY_WORDS),
+        tuple(colors[:3]),
+    )
+
+def signature_key(sig: Signature) -> str:
+    # stable across processes (unlike hash()): seeds the per-intake RNG and is part of
+    # response_cache.response_key
+    return hashlib.sha1(json.dumps(sig, ensure_ascii=False).encode("utf-8")).hexdigest()[:20]
+
+@lru_cache(maxsize=None)
+def category_terms(styles: Tuple[str, ...]) -> Dict[str, Tuple[str, ...]]:
+    return {cat: tuple(kw + [t for s in styles for t in STYLE_MOD.get(s, {}).get(cat, [])]) for cat, kw in BASE_TERMS.items()}
+
+# every normalized style set (one or two styles) up front
+for _n in (1, 2):
+    for _styles in itertools.product(STYLE_KEYWORDS, repeat=_n):
+        category_terms(_styles)
+
+def rng_for(sig: Signature) -> random.Random:
+    # per-intake RNG: no shared global state, and the same intake always draws the same
+    return random.Random(int(signature_key(sig), 16))
+
+@lru_cache(maxsize=4096)
+def compile_queries(sig: Signature, variants: int = 1) -> Dict[str, Tuple[str, ...]]:
+    return build_queries(sig, rng_for(sig), variants)
+
+def build_queries(sig: Signature, rnd: random.Random, variants: int = 1) -> Dict[str, Tuple[str, ...]]:
+    # `variants` distinct keyword/color combinations per category, drawn from `rnd`
+    country, gender, styles, fit, acc_flags, colors = sig
+    gterm = GENDER_TERMS.get(gender, ["unisex"])[0]
+    suffix = f" ({SITE_FILTERS.get(country) or SITE_FILTERS['NL']})"
+    if fit:
+        suffix += f" {fit}"
+    acc_words = [w for on, (_, words) in zip(acc_flags, ACCESSIBILITY_WORDS) if on for w in words]
+    if acc_words:
+        suffix += " " + " ".join(acc_words)
+    queries = {}
+    for cat, terms in category_terms(styles).items():
+        pairs = [(t, c) for t in terms for c in colors]
+        picks = rnd.sample(pairs, min(max(1, variants), len(pairs)))
+        queries[cat] = tuple(f"{gterm} {t} {c}{suffix}" for t, c in picks)
+    return queries
+
+# --- Live-search queries (main.py) --------------------------------------------
+
+SHOPPING_TERMS = {
+    "outer": "jacket blazer overshirt coat",
+    "top1": "shirt knit sweater",
+    "top2": "shirt knit sweater",
+    "tee": "t-shirt tee",
+    "bottom": "chino trousers jeans",
+    "shoes": "sneakers shoes",
+    "belt": "belt",
+}
+SHOPPING_GENDER = {"male": "men", "female": "women"}
+
+@lru_cache(maxsize=8192)
+def shopping_query(cat: str, gender: str, styles: Tuple[str, ...], colors: Tuple[str, ...]) -> str:
+    parts = [SHOPPING_GENDER.get(gender, "unisex"), " ".join(styles), SHOPPING_TERMS.get(cat, "clothing"), " ".join(colors)]
+    return " ".join(x for x in parts if x).strip()
@@ -0,0 +1,188 @@
+import os, time, asyncio, hashlib, threading
+from typing import Any, Dict, List, Optional
+
+from shared_db import connect, db_path as shared_path
+
+# SerpAPI bills per search. Per API key: token buckets sized to the plan (hourly
+# throughput and, optionally, the monthly allowance); per request: a hard cap on
+# upstream calls. 0 disables a limit.
+QUOTA_PER_HOUR = float(os.getenv("SERP_QUOTA_PER_HOUR", "0"))
+QUOTA_BURST = float(os.getenv("SERP_QUOTA_BURST", "0")) or QUOTA_PER_HOUR
+QUOTA_PER_MONTH = float(os.getenv("SERP_QUOTA_PER_MONTH", "0"))
+MAX_CALLS_PER_REQUEST = int(os.getenv("SERP_MAX_CALLS_PER_REQUEST", "32"))
+# With a database, buckets and counters are shared by every worker process using it
+QUOTA_DB = shared_path("quota.db", "QUOTA_DB")
+
+MONTH = 30 * 24 * 3600.0
+
+class QuotaExceeded(RuntimeError):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, n: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens < n: return False
+            self.tokens -= n
+            return True
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+class SharedTokenBucket:
+    # TokenBucket kept in SQLite: processes sharing the file spend from one allowance.
+    # Wall-clock time, since monotonic clocks aren't comparable between processes.
+    def __init__(self, db, lock: threading.Lock, name: str, rate: float, capacity: float):
+        self.db, self._lock = db, lock
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+
+    def _tokens(self, row, now: float) -> float:
+        if row is None: return self.capacity
+        return min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+
+    def take(self, n: float = 1.0) -> bool:
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")  # no other process between our read and write
+            try:
+                now = time.time()
+                tokens = self._tokens(self.db.execute("SELECT tokens, updated FROM quota_buckets WHERE name = ?", (self.name,)).fetchone(), now)
+                ok = tokens >= n
+                if ok:
+                    self.db.execute("INSERT OR REPLACE INTO quota_buckets (name, tokens, updated) VALUES (?, ?, ?)", (self.name, tokens - n, now))
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+            return ok
+
+    def available(self) -> float:
+        with self._lock:
+            row = self.db.execute("SELECT tokens, updated FROM quota_buckets WHERE name = ?", (self.name,)).fetchone()
+        return self._tokens(row, time.time())
+
+def fingerprint(key: str) -> str:
+    # never expose the key itself in stats
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:10]
+
+class KeyQuota:
+    def __init__(self, per_hour: float = QUOTA_PER_HOUR, burst: float = QUOTA_BURST, per_month: float = QUOTA_PER_MONTH,
+                 db_path: Optional[str] = None):
+        self.per_hour, self.burst, self.per_month = per_hour, burst, per_month
+        self._buckets: Dict[str, List[TokenBucket]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = connect(db_path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS quota_buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS quota_counts (fp TEXT PRIMARY KEY, calls INTEGER DEFAULT 0, throttled INTEGER DEFAULT 0)")
+            self._db.commit()
+
+    def bucket(self, name: str, rate: float, capacity: float):
+        # a TokenBucket, shared between processes when the quota has a database
+        if self._db is None: return TokenBucket(rate, capacity)
+        return SharedTokenBucket(self._db, self._db_lock, name, rate, capacity)
+
+    def _for(self, fp: str) -> List[TokenBucket]:
+        with self._lock:
+            if fp not in self._buckets:
+                buckets = []
+                if self.per_hour > 0: buckets.append(self.bucket(f"{fp}:hour", self.per_hour / 3600.0, self.burst or self.per_hour))
+                if self.per_month > 0: buckets.append(self.bucket(f"{fp}:month", self.per_month / MONTH, self.per_month))
+                self._buckets[fp] = buckets
+                self._counts[fp] = {"calls": 0, "throttled": 0}
+            return self._buckets[fp]
+
+    def _count(self, fp: str, what: str):
+        if self._db is None:
+            self._counts[fp][what] += 1
+            return
+        with self._db_lock:
+            self._db.execute(f"INSERT INTO quota_counts (fp, {what}) VALUES (?, 1) ON CONFLICT(fp) DO UPDATE SET {what} = {what} + 1", (fp,))
+            self._db.commit()
+
+    def take(self, key: str) -> bool:
+        fp = fingerprint(key)
+        buckets = self._for(fp)
+        # check every bucket before spending from any, so a refusal costs nothing
+        if any(b.available() < 1 for b in buckets) or not all(b.take() for b in buckets):
+            self._count(fp, "throttled")
+            return False
+        self._count(fp, "calls")
+        return True
+
+    async def atake(self, key: str) -> bool:
+        # take() for the event loop: shared buckets are SQLite writes that can wait on other workers
+        return self.take(key) if self._db is None else await asyncio.to_thread(self.take, key)
+
+    def stats(self) -> Dict[str, Any]:
+        if self._db is None:
+            with self._lock:
+                counts = {fp: dict(c) for fp, c in self._counts.items()}
+        else:
+            with self._db_lock:
+                counts = {fp: {"calls": c, "throttled": t} for fp, c, t in self._db.execute("SELECT fp, calls, throttled FROM quota_counts")}
+        return {
+            "per_hour": self.per_hour,
+            "per_month": self.per_month,
+            "max_calls_per_request": MAX_CALLS_PER_REQUEST,
+            "shared": self._db is not None,
+            "keys": {fp: dict(c, remaining=[int(b.available()) for b in self._for(fp)]) for fp, c in counts.items()},
+        }
+
+class RequestUsage:
+    # Upstream calls made on behalf of one /api/generate request
+    def __init__(self, key: str, limit: int = MAX_CALLS_PER_REQUEST, quota: Optional[KeyQuota] = None):
+        self.key = key
+        self.limit = limit
+        self.quota = quota or QUOTA
+        self.lookups = 0   # SerpAPI lookups asked for, cached or not
+        self.calls = 0     # lookups that went upstream (billed)
+        self.skipped = 0   # lookups refused or left out because the budget ran out
+
+    @property
+    def exhausted(self) -> bool:
+        return bool(self.limit) and self.calls >= self.limit
+
+    def charge(self):
+        if self.exhausted:
+            self.skipped += 1
+            raise QuotaExceeded(f"request budget of {self.limit} SerpAPI calls spent")
+        if not self.quota.take(self.key):
+            self.skipped += 1
+            raise QuotaExceeded("SerpAPI quota for this key is used up")
+        self.calls += 1
+
+    async def acharge(self):
+        # charge() without blocking the event loop on a shared quota. The call is counted
+        # before the wait, so concurrent lookups of this request see the budget shrink
+        if self.exhausted:
+            self.skipped += 1
+            raise QuotaExceeded(f"request budget of {self.limit} SerpAPI calls spent")
+        self.calls += 1
+        if not await self.quota.atake(self.key):
+            self.calls -= 1
+            self.skipped += 1
+            raise QuotaExceeded("SerpAPI quota for this key is used up")
+
+    def report(self) -> Dict[str, Any]:
+        return {"lookups": self.lookups, "upstream_calls": self.calls, "cached": self.lookups - self.calls - self.skipped,
+                "skipped": self.skipped, "max_calls": self.limit}
+
+QUOTA = KeyQuota(db_path=QUOTA_DB)
@@ -0,0 +1,116 @@
+import os, json, time, asyncio, hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from metrics import Counter
+from outfit_engine import intake_signature
+from payload import compact, dumps
+from queries import signature_key
+from singleflight import AsyncSingleFlight
+
+# Whole /api/generate responses, keyed on the normalized intake. Fresh for TTL
+# seconds, then served stale for up to STALE more while one refresh runs behind it.
+TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+STALE = float(os.getenv("RESPONSE_CACHE_STALE", str(6 * 3600)))
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+# Intake fields neither pipeline reads yet; left out of the key so they don't split it.
+# Take a field out of this set as soon as generation starts using it.
+IGNORED_FIELDS = {"purpose", "age_range", "sizes", "materials_avoid", "sustainability_preference"}
+# Fields the compiled-query signature (queries.py) covers; they enter the key through its
+# signature_key. Styles and colors stay in as well: the plain shopping query uses them as given
+SIGNATURE_FIELDS = {"country", "gender", "fit", "accessibility"}
+
+RESPONSE_CACHE_LOOKUPS = Counter("anna_response_cache_total", "Whole-response cache lookups", ("result",))
+
+def _norm(v: Any) -> Any:
+    if isinstance(v, str): return " ".join(v.split()).lower()
+    if isinstance(v, dict): return {k: _norm(x) for k, x in v.items() if x not in (None, "", [], {}, False)}
+    if isinstance(v, (list, tuple)): return sorted({_norm(x) for x in v if x not in (None, "")}, key=str)
+    if isinstance(v, float) and v.is_integer(): return int(v)
+    return v
+
+def response_key(intake: Dict[str, Any], mode: str, outfits_count: int) -> str:
+    # case/whitespace/order-insensitive: styles and colors as sets, budget to whole euros
+    skip = IGNORED_FIELDS | SIGNATURE_FIELDS
+    norm = {k: _norm(v) for k, v in intake.items() if k not in skip and v not in (None, "", [], {})}
+    for k in ("budget_total", "budget_per_item"):
+        if isinstance(norm.get(k), (int, float)): norm[k] = round(norm[k])
+    sig = signature_key(intake_signature(intake))
+    doc = json.dumps([mode or "serpapi", outfits_count, sig, norm], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(doc.encode("utf-8")).hexdigest()
+
+class Entry(NamedTuple):
+    value: Any
+    body: bytes  # rendered like JSONResponse
+    etag: str
+    fresh_until: float
+    stale_until: float
+    compact: bytes  # payload.compact(value), rendered
+    memo: Any = None  # pipeline.Memo of the run, for delta sessions opened on this answer
+
+    def representation(self, fmt: Optional[str]) -> Tuple[bytes, str]:
+        # body and ETag for the requested format; both forms come from the same result
+        if fmt == "compact": return self.compact, self.etag[:-1] + '-c"'
+        return self.body, self.etag
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header: return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+class ResponseCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: float = TTL, stale: float = STALE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale = stale
+        self.flight = AsyncSingleFlight()
+        self._mem: "OrderedDict[str, Entry]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.counts = {"hit": 0, "stale": 0, "miss": 0, "not_modified": 0, "refreshed": 0}
+
+    def count(self, result: str):
+        self.counts[result] += 1
+        RESPONSE_CACHE_LOOKUPS.inc(result)
+
+    def get(self, key: str) -> Tuple[Optional[Entry], str]:
+        now = time.time()
+        e = self._mem.get(key)
+        if e is None or e.stale_until <= now:
+            if e is not None: self._mem.pop(key, None)
+            return None, "miss"
+        self._mem.move_to_end(key)
+        return e, ("hit" if e.fresh_until > now else "stale")
+
+    def entry(self, value: Any, memo: Any = None) -> Entry:
+        # the rendered answer, without keeping it
+        body = dumps(value)
+        now = time.time()
+        return Entry(value, body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"', now + self.ttl, now + self.ttl + self.stale,
+                     dumps(compact(value)), memo)
+
+    def put(self, key: str, value: Any, memo: Any = None) -> Entry:
+        e = self.entry(value, memo)
+        # a result without a single item is an upstream failure, not an answer worth keeping
+        if any(o.get("items") for o in (value or {}).get("outfits") or []):
+            self._mem[key] = e
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+        return e
+
+    def revalidate(self, key: str, refresh: Callable[[], Awaitable[Any]]):
+        # at most one background refresh per key; its failure just leaves the stale entry
+        if key in self._refreshing: return
+        task = asyncio.ensure_future(refresh())
+        self._refreshing[key] = task
+        def done(t):
+            self._refreshing.pop(key, None)
+            if not t.cancelled() and t.exception() is None: self.counts["refreshed"] += 1
+        task.add_done_callback(done)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counts, entries=len(self._mem), max_entries=self.max_entries,
+                    ttl=self.ttl, stale_for=self.stale, refreshing=len(self._refreshing))
+
+RESPONSE_CACHE = ResponseCache()
@@ -0,0 +1,325 @@
+import os, re, json, zlib, urllib.parse
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from catalog import Catalog
+from link_index import LINK_INDEX, LinkIndex, host_of, merchant_host, on_domain
+from metrics import SWALLOWED
+from outfit_engine import DEMO_CATALOG, QUERY_VARIANTS, _normalize_styles, _pick_palette, intake_signature
+from quota import MAX_CALLS_PER_REQUEST, RequestUsage
+from queries import compile_queries, shopping_query
+from serp_cache import SERP_CACHE
+from serp_client import ASYNC_SERP_CLIENT
+
+# The search and resolve stages of the pipeline (pipeline.py), per source of products:
+# live SerpAPI, the offline catalog ("demo") and a recorded SerpAPI session ("fixture").
+
+# Recorded session for mode "fixture": JSONL of {"params", "response"} lines, as written
+# by `bench/fake_serpapi.py --record`
+FIXTURE_PATH = os.getenv("ANNA_FIXTURE", "")
+
+class SearchBackend:
+    name = ""
+    explanation = ""
+    independent_note = "Onpartijdig: geen affiliate."
+
+    def queries(self, cat: str, intake: dict, plan: dict) -> Tuple[Hashable, ...]:
+        # what to search for one category; equal queries are searched once per request or batch
+        raise NotImplementedError
+
+    async def search(self, query: Hashable, gl: str, usage: Optional[RequestUsage] = None) -> List[dict]:
+        raise NotImplementedError
+
+    async def resolve(self, item: dict, gl: str, usage: Optional[RequestUsage] = None) -> Optional[str]:
+        # the link shown for a picked result; None leaves the item out
+        return item.get("link")
+
+    def usage(self, intakes: int = 1) -> Optional[RequestUsage]:
+        return None
+
+    def found_link(self, item: dict) -> Optional[str]:
+        # the link as the search returned it, for items left unresolved (deltas)
+        return item.get("link") or item.get("product_link")
+
+    def palette(self, intake: dict) -> dict:
+        # the colours the response reports; a backend that searches by palette returns the one it uses
+        return {"colors": intake.get("favorite_colors") or ["navy","wit","grijs","zwart"]}
+
+    def explain(self, intake: dict, plan: dict) -> str:
+        return self.explanation
+
+# --- SerpAPI ------------------------------------------------------------------
+
+# Part of the response that gets cached, per engine (the whole response if not listed)
+_RESULT_FIELD = {"google_shopping": "shopping_results", "google": "organic_results"}
+
+async def _serp_get(params: dict, usage: Optional[RequestUsage] = None) -> dict:
+    # only cache misses get here, so this is where a search is billed
+    if usage is not None: await usage.acharge()
+    return await ASYNC_SERP_CLIENT.get(params)
+
+async def _serp_load(params: dict, usage: Optional[RequestUsage] = None):
+    data = await _serp_get(params, usage)
+    field = _RESULT_FIELD.get(params.get("engine"))
+    return (data.get(field, []) or []) if field else data
+
+async def refresh(params: dict):
+    # upstream fetch that replaces the cached value regardless of its age (prewarm)
+    await SERP_CACHE.aset(params, await _serp_load(params))
+
+def _first_url(d: dict) -> Optional[str]:
+    fields = ("link","product_link","product_page_url","product_url","source_url","redirect_link","url")
+    candidates = []
+    for k in fields:
+        v = d.get(k)
+        if isinstance(v,str) and v.strip():
+            candidates.append(v.strip())
+    if not candidates: return None
+    for u in candidates:
+        if "google.com" not in u and "shopping.google" not in u:
+            return u
+    return candidates[0]
+
+def _normalize_link(url: Optional[str], title: str="", merchant: str="") -> str:
+    if not url:
+        q = urllib.parse.quote_plus(f"{title} {merchant}".strip())
+        return f"https://www.google.com/search?q={q}"
+    u = url.strip()
+    if u.startswith("//"): u = "https:" + u
+    if not re.match(r"^https?://", u): u = "https://" + u
+    try:
+        pu = urllib.parse.urlparse(u)
+        qs = urllib.parse.parse_qs(pu.query)
+        junk = {"utm_source","utm_medium","utm_campaign","utm_content","gclid","fbclid","msclkid","aff","affid","cjevent","irclickid","irgwc","_ga","_gl"}
+        for k in list(qs.keys()):
+            if k in junk: qs.pop(k, None)
+        new_q = urllib.parse.urlencode({k:v[0] for k,v in qs.items()})
+        u = urllib.parse.urlunparse((pu.scheme,pu.netloc,pu.path,"",new_q,""))
+    except: SWALLOWED.inc("normalize_link")
+    return u
+
+def _prefer_nl_be(link: str) -> bool:
+    try:
+        host = urllib.parse.urlparse(link).netloc.lower()
+        return host.endswith(".nl") or host.endswith(".be")
+    except:
+        SWALLOWED.inc("prefer_nl_be")
+        return False
+
+def item_key(item: dict) -> str:
+    # one product across results, requests and the link index
+    pid = item.get("product_id")
+    if pid: return f"pid:{pid}"
+    merchant = item.get("source") or item.get("seller") or ""
+    return f"tm:{item.get('title','')}|{merchant}".lower()
+
+def _is_direct_product_url(url: str) -> bool:
+    try:
+        u = urllib.parse.urlparse(url)
+        host = u.netloc.lower()
+        if any(b in host for b in ["google.com","shopping.google","googleadservices","doubleclick"]): return False
+        segs = [s for s in u.path.split("/") if s]
+        return len(segs) >= 1
+    except:
+        SWALLOWED.inc("direct_url")
+        return False
+
+class SerpApiBackend(SearchBackend):
+    name = "serpapi"
+    explanation = "Selectie live gezocht in NL/BE shops; links leiden rechtstreeks naar productpagina’s (prijs/maat/bestellen aanwezig)."
+
+    def __init__(self, key: str, variants: int = QUERY_VARIANTS, links: LinkIndex = LINK_INDEX):
+        self.key = key
+        self.variants = variants
+        self.links = links
+
+    def queries(self, cat: str, intake: dict, plan: dict) -> Tuple[str, ...]:
+        q = shopping_query(cat, (intake.get("gender") or "unisex").lower(),
+                           tuple(intake.get("styles") or []), tuple(intake.get("favorite_colors") or []))
+        if self.variants <= 1: return (q,)
+        # extra variants: the compiled site-filtered queries (queries.py), pooled with the plain one
+        return (q,) + compile_queries(intake_signature(intake), self.variants - 1).get("accessory" if cat == "belt" else cat, ())
+
+    def usage(self, intakes: int = 1) -> Optional[RequestUsage]:
+        return RequestUsage(self.key, limit=MAX_CALLS_PER_REQUEST * max(1, intakes))
+
+    async def fetch(self, params: dict, usage: Optional[RequestUsage] = None):
+        if usage is not None: usage.lookups += 1
+        return await SERP_CACHE.afetch(params, lambda: _serp_load(params, usage))
+
+    async def search(self, query: str, gl: str, usage: Optional[RequestUsage] = None, num: int = 16) -> List[dict]:
+        return await self.fetch({"engine":"google_shopping","q":query,"gl":gl,"hl":"nl","num":num,"api_key":self.key}, usage)
+
+    async def product(self, product_id: str, gl: str, usage: Optional[RequestUsage] = None):
+        return await self.fetch({"engine":"google_shopping_product","product_id":product_id,"gl":gl,"hl":"nl","api_key":self.key}, usage)
+
+    async def web(self, q: str, gl: str, num: int = 10, usage: Optional[RequestUsage] = None):
+        return await self.fetch({"engine":"google","q":q,"gl":gl,"hl":"nl","num":num,"api_key":self.key}, usage)
+
+    async def resolve(self, item: dict, gl: str, usage: Optional[RequestUsage] = None) -> Optional[str]:
+        link = await self._resolve_direct_link(item, gl, usage)
+        return link if _is_direct_product_url(link) else None
+
+    async def _learned(self, key: str, gl: str, link: str, merchant: str = "", domain: Optional[str] = None) -> str:
+        # the merchant's domain is confirmed (or contradicted) only by a link on a host that is
+        # provably the merchant's: its known domain, or named after it as a whole. A looser name
+        # match still picks the link, but teaches the index nothing about the merchant
+        if _is_direct_product_url(link):
+            host = host_of(link)
+            own = merchant and ((domain and on_domain(host, domain)) or merchant_host(merchant, host))
+            await self.links.alearn(key, gl, link, merchant if own else "")
+        return link
+
+    async def _resolve_direct_link(self, item: dict, gl: str, usage: Optional[RequestUsage] = None) -> str:
+        title = item.get("title","")
+        merchant = item.get("source") or item.get("seller") or ""
+        u = _first_url(item)
+        if u and "google.com" not in u and "shopping.google" not in u:
+            return _normalize_link(u, title, merchant)
+
+        # resolved before: no lookups at all
+        key = item_key(item)
+        known = self.links.product(key, gl)
+        if known: return known
+        domain = self.links.domain(merchant, gl)
+
+        pid = item.get("product_id")
+        if not pid and u:
+            m = re.search(r"/product/(\d+)", u)
+            pid = m.group(1) if m else None
+
+        if pid:
+            try:
+                data = await self.product(pid, gl, usage)
+                sellers = data.get("sellers_results") or []
+                if merchant:
+                    m0 = merchant.lower().split()[0]
+                    for s in sellers:
+                        link = s.get("link") or ""
+                        store = (s.get("source") or s.get("seller") or s.get("store") or "").lower()
+                        if (domain and on_domain(host_of(link), domain)) or (m0 and (m0 in store or m0 in link.lower())):
+                            if link and "google.com" not in link:
+                                return await self._learned(key, gl, _normalize_link(link, title, store or merchant), merchant, domain)
+                best = None
+                for s in sellers:
+                    link = s.get("link")
+                    if link and "google.com" not in link:
+                        if _prefer_nl_be(link): return await self._learned(key, gl, _normalize_link(link, title, merchant))
+                        best = best or link
+                if best: return await self._learned(key, gl, _normalize_link(best, title, merchant))
+            except Exception:
+                # not a bare except: a deadline cancellation must not fall through to the web search
+                SWALLOWED.inc("product_lookup")
+
+        # the web search is the least useful lookup; skip it once the request budget is spent
+        if usage is not None and usage.exhausted:
+            usage.lookups += 1; usage.skipped += 1
+            return _normalize_link(None, title, merchant)
+        organics = await self.web(f"{title} {merchant}".strip(), gl, num=10, usage=usage)
+        for r in organics:
+            link = r.get("link")
+            if not isinstance(link,str): continue
+            if "google.com" in link: continue
+            host = host_of(link)
+            if (domain and on_domain(host, domain)) or merchant_host(merchant, host):
+                return await self._learned(key, gl, _normalize_link(link, title, merchant), merchant, domain)
+        for r in organics:
+            link = r.get("link")
+            if isinstance(link,str) and link.strip() and "google.com" not in link and _prefer_nl_be(link):
+                return await self._learned(key, gl, _normalize_link(link, title, merchant))
+        for r in organics:
+            link = r.get("link")
+            if isinstance(link,str) and link.strip() and "google.com" not in link:
+                return await self._learned(key, gl, _normalize_link(link, title, merchant))
+
+        return _normalize_link(None, title, merchant)
+
+class FixtureBackend(SerpApiBackend):
+    # SerpAPI answered from a recording: no network, no cache, no quota and its own link
+    # index. Params without an exact match get a recorded response of the same engine,
+    # picked by hashing the params.
+    name = "fixture"
+
+    def __init__(self, path: str = FIXTURE_PATH, variants: int = 1):
+        super().__init__("", variants, LinkIndex())
+        self.exact: Dict[str, Any] = {}
+        self.by_engine: Dict[str, list] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip(): continue
+                rec = json.loads(line)
+                params = {k: str(v) for k, v in rec["params"].items()}
+                self.exact[self._key(params)] = rec["response"]
+                self.by_engine.setdefault(params.get("engine", ""), []).append(rec["response"])
+
+    @staticmethod
+    def _key(params: dict) -> str:
+        return json.dumps({k: str(v) for k, v in params.items() if k != "api_key"}, sort_keys=True)
+
+    def usage(self, intakes: int = 1) -> Optional[RequestUsage]:
+        return None
+
+    async def fetch(self, params: dict, usage: Optional[RequestUsage] = None):
+        k = self._key(params)
+        data = self.exact.get(k)
+        if data is None:
+            pool = self.by_engine.get(params.get("engine", ""))
+            data = pool[zlib.crc32(k.encode()) % len(pool)] if pool else {}
+        field = _RESULT_FIELD.get(params.get("engine"))
+        return (data.get(field, []) or []) if field else data
+
+# --- Offline catalog ----------------------------------------------------------
+
+class CatalogBackend(SearchBackend):
+    # catalog.py index lookups; no network, links as stored in the catalog
+    name = "demo"
+    explanation = "Demo-selectie uit de offline catalogus; links zijn voorbeelden."
+
+    def __init__(self, catalog: Optional[Catalog] = None):
+        self.catalog = catalog or DEMO_CATALOG
+
+    def palette(self, intake: dict) -> dict:
+        return _pick_palette(_normalize_styles(intake.get("styles") or []), intake.get("favorite_colors"))
+
+    def queries(self, cat: str, intake: dict, plan: dict) -> Tuple[tuple, ...]:
+        styles = _normalize_styles(intake.get("styles") or [])
+        colors = tuple(plan["palette"]["colors"])
+        # the cap narrows large catalogs to the candidates around this category's share
+        return (("accessory" if cat == "belt" else cat, (intake.get("gender") or "unisex").lower(),
+                 tuple(styles), colors, round(plan["alloc"][cat], 2)),)
+
+    def explain(self, intake: dict, plan: dict) -> str:
+        styles = _normalize_styles(intake.get("styles") or [])
+        colors = plan["palette"]["colors"]
+        return (
+            f"We kozen een palet rond {', '.join(colors[:4])}. "
+            f"De selectie volgt de stijlen {', '.join(styles)} (≈70%) met een speelse aanvulling (≈30%). "
+            f"Budgetbewaking: totaal ≈ €{plan['alloc']['_total']:.0f} met ±10% marge per item. "
+            "Per item is één goedkoper alternatief toegevoegd waar mogelijk."
+        )
+
+    async def search(self, query: tuple, gl: str, usage: Optional[RequestUsage] = None) -> List[dict]:
+        cat, gender, styles, colors, cap = query
+        return self.catalog.search(cat, gender, list(styles), colors, price_cap=cap)
+
+BACKENDS = ("serpapi", "demo", "fixture")
+
+def backend_for(mode: Optional[str], key: str = "") -> SearchBackend:
+    # ValueError for an unknown mode, or a mode that can't run here
+    mode = (mode or "serpapi").lower()
+    if mode == "serpapi":
+        if not key: raise ValueError("Geen SERPAPI key.")
+        return SerpApiBackend(key)
+    if mode == "demo":
+        return CatalogBackend()
+    if mode == "fixture":
+        if not FIXTURE_PATH: raise ValueError("Geen fixture: zet ANNA_FIXTURE.")
+        return _fixture()
+    raise ValueError(f"Onbekende modus '{mode}' (kies uit {', '.join(BACKENDS)}).")
+
+_FIXTURES: Dict[str, FixtureBackend] = {}
+
+def _fixture() -> FixtureBackend:
+    # the recording is read once per process
+    if FIXTURE_PATH not in _FIXTURES:
+        _FIXTURES[FIXTURE_PATH] = FixtureBackend(FIXTURE_PATH)
+    return _FIXTURES[FIXTURE_PATH]
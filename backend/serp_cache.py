@@ -0,0 +1,226 @@
+import os, re, json, math, time, asyncio, threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import CACHE_LOOKUPS
+from shared_db import connect, db_path as shared_path
+from singleflight import AsyncSingleFlight
+
+# Seconds a response stays fresh, per SerpAPI engine
+DEFAULT_TTLS = {
+    "google_shopping": float(os.getenv("SERP_CACHE_TTL_SHOPPING", str(6 * 3600))),
+    "google_shopping_product": float(os.getenv("SERP_CACHE_TTL_PRODUCT", str(24 * 3600))),
+    "google": float(os.getenv("SERP_CACHE_TTL_WEB", str(24 * 3600))),
+}
+FALLBACK_TTL = 3600.0
+# Popularity per key is a hit count that halves every POPULARITY_HALF_LIFE seconds
+POPULARITY_HALF_LIFE = float(os.getenv("SERP_CACHE_POPULARITY_HALF_LIFE", "3600"))
+# With a shared database, a miss another process is already fetching is awaited (polling
+# the database) for up to CLAIM_WAIT seconds instead of being fetched a second time
+CLAIM_WAIT = float(os.getenv("SERP_CACHE_CLAIM_WAIT", "5"))
+CLAIM_POLL = 0.05
+
+def cache_key(params: Dict[str, Any]) -> str:
+    # engine + params, minus the api key; whitespace/case-insensitive on string values
+    norm = {}
+    for k, v in params.items():
+        if k == "api_key" or v is None: continue
+        if isinstance(v, str): v = re.sub(r"\s+", " ", v.strip().lower())
+        norm[k] = v
+    return json.dumps(norm, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def _original(params: Dict[str, Any]) -> Dict[str, Any]:
+    # what to refresh an entry with: the key is normalized, and Google reads "OR" and "or" differently
+    return {k: v for k, v in params.items() if k != "api_key"}
+
+class SerpCache:
+    def __init__(self, max_entries: int = 2048, ttls: Optional[Dict[str, float]] = None, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.hits = 0
+        self.misses = 0
+        self.from_others = 0
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pop: Dict[str, Tuple[float, float]] = {}  # key -> (score, updated)
+        self._lock = threading.Lock()
+        self._aflight = AsyncSingleFlight()
+        self._db = None
+        if db_path:
+            self._db = connect(db_path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS serp_cache (key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS serp_claims (key TEXT PRIMARY KEY, until REAL)")
+            self._db.execute("DELETE FROM serp_cache WHERE expires < ?", (time.time(),))
+            self._db.commit()
+
+    def ttl_for(self, params: Dict[str, Any]) -> float:
+        return self.ttls.get(params.get("engine"), FALLBACK_TTL)
+
+    def get(self, params: Dict[str, Any]) -> Optional[Any]:
+        key, now = cache_key(params), time.time()
+        with self._lock:
+            self._touch(key, now)
+            hit = self._mem.get(key)
+            if hit and hit[0] > now:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(params.get("engine", ""), "hit")
+                return hit[1]
+            if hit: self._mem.pop(key, None)
+            if self._db is not None:
+                row = self._db.execute("SELECT expires, value FROM serp_cache WHERE key = ?", (key,)).fetchone()
+                if row and row[0] > now:
+                    value = json.loads(row[1])
+                    self._put(key, row[0], value, _original(params))
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc(params.get("engine", ""), "hit")
+                    return value
+            self.misses += 1
+            CACHE_LOOKUPS.inc(params.get("engine", ""), "miss")
+            return None
+
+    def set(self, params: Dict[str, Any], value: Any):
+        key = cache_key(params)
+        expires = time.time() + self.ttl_for(params)
+        with self._lock:
+            self._put(key, expires, value, _original(params))
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO serp_cache (key, expires, value) VALUES (?, ?, ?)",
+                                 (key, expires, json.dumps(value, ensure_ascii=False)))
+                self._db.execute("DELETE FROM serp_claims WHERE key = ?", (key,))
+                self._db.commit()
+
+    async def _io(self, fn, *args):
+        # with a database, from a worker thread: a commit can wait up to BUSY_TIMEOUT on
+        # another process's write, and the event loop must not wait with it
+        return fn(*args) if self._db is None else await asyncio.to_thread(fn, *args)
+
+    async def aget(self, params: Dict[str, Any]) -> Optional[Any]:
+        return await self._io(self.get, params)
+
+    async def aset(self, params: Dict[str, Any], value: Any):
+        await self._io(self.set, params, value)
+
+    async def afetch(self, params: Dict[str, Any], loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = await self.aget(params)
+        if value is not None: return value
+        key = cache_key(params)
+        async def load():
+            if self._db is not None and not await self._io(self._claim, key):
+                value = await self._from_other(key, params)
+                if value is not None: return value
+            try:
+                value = await loader()
+            except BaseException:
+                if self._db is not None: await self._io(self._release, key)
+                raise
+            await self.aset(params, value)
+            return value
+        return await self._aflight.do(key, load)
+
+    def _claim(self, key: str) -> bool:
+        # True when this process should fetch `key`; False while another one is on it
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute("INSERT INTO serp_claims (key, until) VALUES (?, ?) ON CONFLICT(key) DO UPDATE "
+                                   "SET until = excluded.until WHERE serp_claims.until < ?", (key, now + CLAIM_WAIT, now))
+            self._db.commit()
+            return cur.rowcount == 1
+
+    def _release(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM serp_claims WHERE key = ?", (key,))
+            self._db.commit()
+
+    async def _from_other(self, key: str, params: Dict[str, Any]) -> Optional[Any]:
+        # the other process's result once it lands; None if it gave up or took too long
+        deadline = time.time() + CLAIM_WAIT
+        while time.time() < deadline:
+            await asyncio.sleep(CLAIM_POLL)
+            value, claimed = await self._io(self._landed, key, params)
+            if value is not None or not claimed: return value
+        return None
+
+    def _landed(self, key: str, params: Dict[str, Any]) -> Tuple[Optional[Any], bool]:
+        # (the other process's result once stored, whether its claim still stands)
+        with self._lock:
+            row = self._db.execute("SELECT expires, value FROM serp_cache WHERE key = ?", (key,)).fetchone()
+            if row and row[0] > time.time():
+                value = json.loads(row[1])
+                self._put(key, row[0], value, _original(params))
+                self.from_others += 1
+                return value, True
+            return None, self._db.execute("SELECT 1 FROM serp_claims WHERE key = ?", (key,)).fetchone() is not None
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self._pop.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM serp_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": len(self._mem),
+            "max_entries": self.max_entries,
+            "persistent": self._db is not None,
+            "coalesced": self._aflight.shared,
+            "from_other_workers": self.from_others,
+        }
+
+    def _put(self, key: str, expires: float, value: Any, params: Dict[str, Any]):
+        self._mem[key] = (expires, value, params)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            old, _ = self._mem.popitem(last=False)
+            self._pop.pop(old, None)
+
+    def _touch(self, key: str, now: float):
+        score, then = self._pop.get(key, (0.0, now))
+        self._pop[key] = (self._decayed(score, then, now) + 1.0, now)
+        if len(self._pop) > 4 * self.max_entries:
+            # keys whose load failed are tracked but never stored; drop them now and then
+            self._pop = {k: v for k, v in self._pop.items() if k in self._mem}
+
+    @staticmethod
+    def _decayed(score: float, then: float, now: float) -> float:
+        return score * math.pow(0.5, (now - then) / POPULARITY_HALF_LIFE)
+
+    def expiring(self, within: float, min_score: float = 0.0, limit: int = 100) -> List[Tuple[float, Dict[str, Any]]]:
+        # (popularity, params without api key) of in-memory entries that expire within
+        # `within` seconds, most popular first
+        now = time.time()
+        out = []
+        with self._lock:
+            for key, (expires, _, params) in self._mem.items():
+                if expires - now > within: continue
+                score, then = self._pop.get(key, (0.0, now))
+                score = self._decayed(score, then, now)
+                if score >= min_score: out.append((score, key, params))
+            if self._db is not None:
+                out = [e for e in out if not self._fresher_in_db(e[1], now + within)]
+        out.sort(key=lambda x: -x[0])
+        return [(round(score, 2), dict(params)) for score, _, params in out[:limit]]
+
+    def _fresher_in_db(self, key: str, until: float) -> bool:
+        # another worker sharing the database already refreshed it: take that copy instead
+        row = self._db.execute("SELECT expires, value FROM serp_cache WHERE key = ?", (key,)).fetchone()
+        if not row or row[0] <= until: return False
+        self._put(key, row[0], json.loads(row[1]), self._mem[key][2])
+        return True
+
+    def popular(self, limit: int = 10) -> List[Tuple[float, Dict[str, Any]]]:
+        now = time.time()
+        with self._lock:
+            scored = [(self._decayed(sc, then, now), key) for key, (sc, then) in self._pop.items()]
+        scored.sort(key=lambda x: -x[0])
+        return [(round(score, 2), json.loads(key)) for score, key in scored[:limit]]
+
+SERP_CACHE = SerpCache(
+    max_entries=int(os.getenv("SERP_CACHE_MAX_ENTRIES", "2048")),
+    db_path=shared_path("serp_cache.db", "SERP_CACHE_DB"),
+)
@@ -0,0 +1,130 @@
+import os, time, random, asyncio, threading, httpx
+from typing import Any, Dict, Optional
+
+from metrics import UPSTREAM_CALLS, UPSTREAM_SECONDS
+
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search.json")
+
+# Pool sized to the number of concurrent upstream calls a worker can make
+POOL_SIZE = int(os.getenv("SERP_POOL_SIZE", "32"))
+CONNECT_TIMEOUT = float(os.getenv("SERP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("SERP_READ_TIMEOUT", "20"))
+MAX_RETRIES = int(os.getenv("SERP_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("SERP_BACKOFF_BASE", "0.25"))
+BACKOFF_MAX = float(os.getenv("SERP_BACKOFF_MAX", "4"))
+BREAKER_THRESHOLD = int(os.getenv("SERP_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("SERP_BREAKER_COOLDOWN", "30"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class CircuitBreaker:
+    # closed -> open after `threshold` consecutive failures; one probe allowed after `cooldown`
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None: return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._probing: return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    if retry_after:
+        try: return min(float(retry_after), BACKOFF_MAX)
+        except ValueError: pass
+    # full jitter
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+class AsyncSerpClient:
+    # Pooled httpx client: retries with jittered backoff on 429/5xx and transport errors, and a
+    # circuit breaker that fails fast once SerpAPI looks down
+    def __init__(self, url: str = SERPAPI_URL, pool_size: int = POOL_SIZE, retries: int = MAX_RETRIES,
+                 timeout: tuple = (CONNECT_TIMEOUT, READ_TIMEOUT), breaker: Optional[CircuitBreaker] = None):
+        self.url = url
+        self.retries = retries
+        self.timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.breaker = breaker or SERP_BREAKER
+        self.calls = 0
+        self.retried = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+
+    def _session(self) -> httpx.AsyncClient:
+        # connections belong to one event loop; start a fresh pool if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+            self._loop = loop
+        return self._client
+
+    async def get(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        engine = params.get("engine", "")
+        if not self.breaker.allow():
+            UPSTREAM_CALLS.inc(engine, "circuit_open")
+            raise CircuitOpenError("SerpAPI circuit open; failing fast")
+        client = self._session()
+        err: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+            self.calls += 1
+            retry_after = None
+            t0 = time.perf_counter()
+            try:
+                r = await client.get(self.url, params=params)
+            except httpx.TransportError as e:
+                err = e
+                UPSTREAM_CALLS.inc(engine, "transport_error")
+            else:
+                UPSTREAM_CALLS.inc(engine, str(r.status_code))
+                if r.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    r.raise_for_status()
+                    return r.json()
+                err = httpx.HTTPStatusError(f"{r.status_code} from SerpAPI", request=r.request, response=r)
+                retry_after = r.headers.get("Retry-After")
+            finally:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - t0, engine)
+            if attempt < self.retries:
+                await asyncio.sleep(_backoff(attempt, retry_after))
+        self.breaker.record_failure()
+        raise err
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "retried": self.retried, "breaker": self.breaker.state}
+
+SERP_BREAKER = CircuitBreaker()
+ASYNC_SERP_CLIENT = AsyncSerpClient()
@@ -0,0 +1,57 @@
+import os, time, secrets, threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Generations a client may follow up with a budget or outfit-count change
+# (/api/generate/delta). A session keeps the intake and the search results and
+# resolved links of its runs (pipeline.Memo), so a change re-runs only the
+# allocation, the pick and the composition.
+TTL = float(os.getenv("SESSION_TTL", "1800"))
+MAX_SESSIONS = int(os.getenv("SESSION_MAX", "512"))
+
+class Session:
+    __slots__ = ("token", "intake", "backend", "outfits_count", "memo", "expires")
+
+    def __init__(self, token: str, intake: dict, backend: Any, outfits_count: int, memo: Any, expires: float):
+        self.token = token
+        self.intake = intake
+        self.backend = backend
+        self.outfits_count = outfits_count
+        self.memo = memo
+        self.expires = expires
+
+class SessionStore:
+    def __init__(self, ttl: float = TTL, max_sessions: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"opened": 0, "deltas": 0, "expired": 0}
+
+    def open(self, intake: dict, backend: Any, outfits_count: int, memo: Any) -> Session:
+        s = Session(secrets.token_urlsafe(16), intake, backend, outfits_count, memo, time.time() + self.ttl)
+        with self._lock:
+            self._sessions[s.token] = s
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            self.counts["opened"] += 1
+        return s
+
+    def get(self, token: str) -> Optional[Session]:
+        now = time.time()
+        with self._lock:
+            s = self._sessions.get(token)
+            if s is None: return None
+            if s.expires <= now:
+                del self._sessions[token]
+                self.counts["expired"] += 1
+                return None
+            # every use extends it
+            s.expires = now + self.ttl
+            self._sessions.move_to_end(token)
+            return s
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counts, active=len(self._sessions), ttl=self.ttl, max_sessions=self.max_sessions)
+
+SESSIONS = SessionStore()
@@ -0,0 +1,32 @@
+import os, sqlite3
+from typing import Optional
+
+# State that several worker processes share (main.py serve --workers N): SerpAPI cache,
+# link index, quota buckets and thumbnails, each in its own SQLite file under STATE_DIR.
+# WAL lets readers run while one process writes; the busy timeout makes writers queue
+# instead of failing with "database is locked".
+STATE_DIR = os.getenv("ANNA_STATE_DIR", "")
+BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+def private_dir(path: str) -> str:
+    # what lives here is for this user only: other local users must not read the thumbnail
+    # secret or write into the caches and quota. Created 0700; an existing directory of ours
+    # is tightened to that, one owned by someone else (say, made in /tmp first) refused
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is owned by another user; choose another directory (ANNA_STATE_DIR, --state-dir)")
+    if st.st_mode & 0o077: os.chmod(path, 0o700)
+    return path
+
+def db_path(name: str, env: str) -> Optional[str]:
+    # the module's own setting wins; otherwise a file in the state dir, if there is one
+    explicit = os.getenv(env)
+    if explicit or not STATE_DIR: return explicit or None
+    return os.path.join(private_dir(STATE_DIR), name)
+
+def connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; a power cut may lose the last commits
+    return db
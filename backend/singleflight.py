@@ -0,0 +1,28 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class AsyncSingleFlight:
+    # Concurrent callers with the same key share one execution of fn (result or exception).
+    # The shared call runs as its own task, so a caller that is cancelled (deadline, client
+    # gone) doesn't cancel it for the others
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: "asyncio.Task"):
+        if self._tasks.get(key) is task:
+            self._tasks.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
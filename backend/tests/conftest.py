@@ -0,0 +1,12 @@
+import os, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), os.path.join(HERE, "..", "..", "bench")]
+
+import fake_serpapi
+
+# One fake upstream for the whole run: the backend modules read their settings when
+# imported, so this has to happen before any test imports them. State stays in memory.
+FAKE = fake_serpapi.start(latency=0.02)
+os.environ.update(SERPAPI_URL=FAKE.url, SERPAPI_API_KEY="test", THUMB_PROXY="0", ANNA_STATE_DIR="", PREWARM_CALLS_PER_HOUR="0")
+for k in ("SERP_CACHE_DB", "LINK_INDEX_DB", "QUOTA_DB"): os.environ.pop(k, None)
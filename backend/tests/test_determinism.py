@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from outfit_engine import EngineConfig, generate_outfits
+
+THREADS = 64
+INTAKES = [{"purpose": p, "styles": s, "gender": g, "country": "NL", "budget_total": b, "favorite_colors": c}
+           for p, s, g, b, c in [("werk", ["klassiek"], "male", 400, ["bordeaux"]), ("date", ["casual"], "female", 200, ["camel"]),
+                                 ("weekend", ["sportief"], "unisex", 150, ["groen"]), ("feest", ["minimalistisch"], "female", 600, ["zwart"])]]
+
+def _run(intake: dict, mode: str) -> str:
+    # several query variants, so the seeded per-intake choice of queries is part of what is compared
+    out = generate_outfits(dict(intake), EngineConfig(mode, "test", query_variants=3))
+    out.pop("usage", None)  # what the call cost, not what it answered
+    return repr(out)
+
+@pytest.mark.parametrize("mode", ["demo", "serpapi"])
+def test_identical_intakes_identical_outputs_in_parallel(mode):
+    with ThreadPoolExecutor(THREADS) as ex:
+        outs = list(ex.map(lambda _: _run(INTAKES[0], mode), range(THREADS)))
+    assert len(set(outs)) == 1
+    assert outs[0] == _run(INTAKES[0], mode)
+
+@pytest.mark.parametrize("mode", ["demo", "serpapi"])
+def test_mixed_intakes_match_their_sequential_outputs(mode):
+    alone = [_run(i, mode) for i in INTAKES]
+    assert len(set(alone)) == len(INTAKES)
+    with ThreadPoolExecutor(THREADS) as ex:
+        outs = list(ex.map(lambda n: _run(INTAKES[n % len(INTAKES)], mode), range(THREADS)))
+    assert outs == [alone[n % len(INTAKES)] for n in range(THREADS)]
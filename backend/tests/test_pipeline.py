@@ -0,0 +1,18 @@
+import asyncio
+
+from outfit_engine import _normalize_styles, _pick_palette
+from pipeline import _price_of, generate
+from search_backends import CatalogBackend
+
+INTAKE = {"purpose": "werk", "styles": ["casual"], "gender": "male", "country": "NL", "budget_total": 250}
+
+def test_demo_reports_the_palette_it_searched_with():
+    result = asyncio.run(generate(dict(INTAKE), CatalogBackend(), 3))
+    colors = _pick_palette(_normalize_styles(INTAKE["styles"]), None)["colors"]
+    assert result["palette"]["colors"] == colors
+    assert ", ".join(colors[:4]) in result["explanation"]
+
+def test_display_prices_are_parsed():
+    assert [_price_of({"price": p}) for p in ("€39,99", "1.299,00 €", "€ 1,299.50", "39")] == [39.99, 1299.0, 1299.5, 39.0]
+    assert _price_of({"price": "€39,99", "extracted_price": 41.5}) == 41.5
+    assert _price_of({"price": "op aanvraag"}) == 0.0
@@ -0,0 +1,16 @@
+import os
+
+import pytest
+
+from serp_cache import SerpCache
+
+QUERY = "Jas  heren navy (site:zalando.nl OR site:hm.com)"
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_expiring_entries_refresh_with_their_original_params(shared, tmp_path):
+    cache = SerpCache(ttls={"google_shopping": 60}, db_path=os.path.join(tmp_path, "serp.db") if shared else None)
+    params = {"engine": "google_shopping", "q": QUERY, "gl": "nl", "api_key": "secret"}
+    cache.set(params, [{"title": "jas"}])
+    # a lookup differing only in case and spacing is the same entry
+    assert cache.get(dict(params, q=QUERY.lower())) == [{"title": "jas"}]
+    assert cache.expiring(within=120) == [(1.0, {"engine": "google_shopping", "q": QUERY, "gl": "nl"})]
@@ -0,0 +1,35 @@
+import asyncio
+
+import httpx
+
+import main
+from conftest import FAKE
+
+INTAKE = {"purpose": "feest", "styles": ["klassiek"], "gender": "male", "country": "NL", "budget_total": 250,
+          "favorite_colors": ["grijs"]}
+
+def _upstream() -> int:
+    with FAKE._lock:
+        return sum(FAKE.calls.values())
+
+async def _session_then(deltas: list):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test", timeout=60) as c:
+        r = await c.post("/api/generate", json={"intake": INTAKE, "mode": "serpapi"})
+        out = []
+        for d in deltas:
+            before = _upstream()
+            res = await c.post("/api/generate/delta", json=dict(d, session=r.headers["X-Session"]))
+            out.append((res, _upstream() - before))
+        before = _upstream()
+        full = await c.post("/api/generate", json={"intake": dict(INTAKE, budget_total=400), "mode": "serpapi"})
+        return out, (full, _upstream() - before)
+
+def test_deltas_make_no_upstream_calls_and_are_not_cached():
+    deltas, (full, calls) = asyncio.run(_session_then([{"budget_total": b} for b in (400, 120, 1000)] + [{"outfits_count": 5}]))
+    for res, made in deltas:
+        assert res.status_code == 200 and made == 0
+        assert res.json()["usage"]["upstream_calls"] == 0
+        assert all(o["items"] for o in res.json()["outfits"])
+    assert len(deltas[-1][0].json()["outfits"]) == 5
+    # a full generation of a budget a delta answered still resolves its own links
+    assert full.headers["X-Cache"] == "miss" and calls > 0
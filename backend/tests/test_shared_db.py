@@ -0,0 +1,12 @@
+import os, stat
+
+from shared_db import private_dir
+
+def _mode(path: str) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_private_dir_is_created_and_kept_owner_only(tmp_path):
+    path = private_dir(os.path.join(tmp_path, "state"))
+    assert _mode(path) == 0o700
+    os.chmod(path, 0o777)
+    assert _mode(private_dir(path)) == 0o700
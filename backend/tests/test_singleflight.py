@@ -0,0 +1,56 @@
+import asyncio
+from collections import Counter
+
+import httpx
+import pytest
+
+import main
+from conftest import FAKE
+from serp_cache import SerpCache
+
+N = 16
+INTAKE = {"purpose": "werk", "styles": ["casual"], "gender": "female", "country": "NL", "budget_total": 300,
+          "favorite_colors": ["olijf"]}
+
+def _calls() -> Counter:
+    with FAKE._lock:
+        return Counter(FAKE.calls)
+
+async def _generate_all(n: int):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test", timeout=60) as c:
+        return await asyncio.gather(*[c.post("/api/generate", json={"intake": INTAKE, "mode": "serpapi"}) for _ in range(n)])
+
+def test_identical_generates_hit_upstream_once_per_lookup():
+    before = _calls()
+    rs = asyncio.run(_generate_all(N))
+    made = _calls() - before
+    assert all(r.status_code == 200 for r in rs)
+    assert made, "the intake should need upstream lookups"
+    assert max(made.values()) == 1, {k: n for k, n in made.items() if n > 1}
+    # one request ran the pipeline and is billed for it; the others joined it
+    billed = sorted(r.json()["usage"]["upstream_calls"] for r in rs)
+    assert billed == [0] * (N - 1) + [sum(made.values())]
+    assert len({str({k: v for k, v in r.json().items() if k != "usage"}) for r in rs}) == 1
+
+def test_concurrent_misses_share_one_load_and_a_failure_is_not_cached():
+    cache, loads = SerpCache(), []
+    params = {"engine": "google_shopping", "q": "jas", "gl": "nl"}
+    async def load(fail: bool):
+        loads.append(fail)
+        await asyncio.sleep(0.02)
+        if fail: raise RuntimeError("upstream down")
+        return [{"title": "jas"}]
+    async def run(fail: bool):
+        return await asyncio.gather(*[cache.afetch(params, lambda: load(fail)) for _ in range(N)], return_exceptions=True)
+    failed = asyncio.run(run(True))
+    assert len(loads) == 1 and all(isinstance(r, RuntimeError) for r in failed)
+    ok = asyncio.run(run(False))
+    assert len(loads) == 2 and ok == [[{"title": "jas"}]] * N
+
+@pytest.mark.parametrize("n", [1, 4])
+def test_response_cache_answers_repeats_without_upstream(n):
+    asyncio.run(_generate_all(1))
+    before = _calls()
+    rs = asyncio.run(_generate_all(n))
+    assert _calls() == before
+    assert all(r.json()["usage"]["upstream_calls"] == 0 for r in rs)
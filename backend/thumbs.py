@@ -0,0 +1,212 @@
+import os, io, hmac, time, asyncio, hashlib, secrets, sqlite3, tempfile, threading, urllib.parse
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from PIL import Image, ImageOps
+
+from metrics import Counter
+from shared_db import STATE_DIR, connect, private_dir
+from singleflight import AsyncSingleFlight
+
+# Item thumbnails served by us instead of the shops' image hosts (/api/img): fetched once,
+# shrunk to the card size (2x for sharp screens), re-encoded to WebP and kept on disk.
+# Files are named after the hash of their bytes, so one picture under several URLs is
+# stored once; an SQLite index maps source URL -> file and picks what to evict once the
+# directory grows past MAX_BYTES. Results link to /api/img?u=...&s=..., where `s` is an
+# HMAC so the endpoint only fetches URLs this server handed out.
+ENABLED = os.getenv("THUMB_PROXY", "1") == "1"
+CACHE_DIR = os.getenv("THUMB_CACHE_DIR") or os.path.join(STATE_DIR or tempfile.gettempdir(), "anna-thumbs")
+MAX_BYTES = int(os.getenv("THUMB_CACHE_MAX_BYTES", str(256 * 2**20)))
+SIZE = int(os.getenv("THUMB_SIZE", "96"))  # longest side in px; cards show them at 48
+QUALITY = int(os.getenv("THUMB_QUALITY", "80"))
+MAX_SOURCE_BYTES = int(os.getenv("THUMB_MAX_SOURCE_BYTES", str(8 * 2**20)))
+MAX_PIXELS = int(os.getenv("THUMB_MAX_PIXELS", str(40_000_000)))
+TIMEOUT = float(os.getenv("THUMB_TIMEOUT", "10"))
+MAX_AGE = int(os.getenv("THUMB_MAX_AGE", str(30 * 86400)))
+
+THUMB_REQUESTS = Counter("anna_thumb_total", "Thumbnail proxy requests", ("result",))
+
+class ThumbError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _secret(cache_dir: str) -> bytes:
+    # THUMB_SECRET, or one generated into the cache dir so every worker using it signs alike
+    env = os.getenv("THUMB_SECRET")
+    if env: return env.encode("utf-8")
+    path = os.path.join(cache_dir, "secret")
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}"
+        with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+            f.write(secrets.token_bytes(32))
+        try: os.link(tmp, path)  # first writer wins
+        except FileExistsError: pass
+        finally: os.unlink(tmp)
+    elif os.stat(path).st_mode & 0o077:
+        os.chmod(path, 0o600)  # written by an older version under the umask
+    with open(path, "rb") as f:
+        return f.read()
+
+def _render(data: bytes, size: int, quality: int) -> bytes:
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if im.width * im.height > MAX_PIXELS: raise ThumbError(422, "Afbeelding is te groot.")
+            im.draft("RGB", (size, size))  # JPEG: decode at a fraction of full size
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((size, size), Image.LANCZOS)
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if im.mode in ("LA", "P", "PA") else "RGB")
+            out = io.BytesIO()
+            im.save(out, "WEBP", quality=quality, method=4)
+            return out.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ThumbError(422, "Geen leesbare afbeelding.")
+
+class ThumbCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_BYTES, size: int = SIZE, quality: int = QUALITY,
+                 timeout: float = TIMEOUT):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = size
+        self.quality = quality
+        self.timeout = timeout
+        self.flight = AsyncSingleFlight()
+        self.counts = {"hit": 0, "fetched": 0, "failed": 0, "evicted": 0}
+        self._key: Optional[bytes] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+
+    def _signing_key(self) -> bytes:
+        if self._key is None:
+            private_dir(self.cache_dir)
+            self._key = _secret(self.cache_dir)
+        return self._key
+
+    def _index(self) -> sqlite3.Connection:
+        # opened on first use, not at import: scripts that never serve images don't touch the disk
+        with self._lock:
+            if self._db is None:
+                private_dir(self.cache_dir)
+                db = connect(os.path.join(self.cache_dir, "index.db"))
+                db.execute("CREATE TABLE IF NOT EXISTS thumbs (src TEXT PRIMARY KEY, digest TEXT, bytes INTEGER, used REAL)")
+                db.commit()
+                self._db = db
+            return self._db
+
+    def sign(self, src: str) -> str:
+        return hmac.new(self._signing_key(), f"{self.size}:{src}".encode("utf-8"), hashlib.sha256).hexdigest()[:20]
+
+    def url_for(self, src: Optional[str]) -> Optional[str]:
+        # what results link to instead of the shop's image host
+        if not ENABLED or not src or not src.startswith(("http://", "https://")): return src
+        return "/api/img?" + urllib.parse.urlencode({"u": src, "s": self.sign(src)})
+
+    def verify(self, src: str, sig: Optional[str]) -> bool:
+        return bool(sig) and hmac.compare_digest(self.sign(src), sig)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest + ".webp")
+
+    def lookup(self, src: str) -> Optional[Tuple[str, bytes]]:
+        db, key, now = self._index(), f"{self.size}:{src}", time.time()
+        with self._lock:
+            row = db.execute("SELECT digest, used FROM thumbs WHERE src = ?", (key,)).fetchone()
+        if row is None: return None
+        try:
+            with open(self._path(row[0]), "rb") as f: data = f.read()
+        except FileNotFoundError:
+            # evicted by another worker sharing the directory
+            with self._lock:
+                db.execute("DELETE FROM thumbs WHERE src = ?", (key,))
+                db.commit()
+            return None
+        if now - row[1] > 60:
+            with self._lock:
+                db.execute("UPDATE thumbs SET used = ? WHERE src = ?", (now, key))
+                db.commit()
+        return row[0], data
+
+    def store(self, src: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f: f.write(data)
+            os.replace(tmp, path)
+        db = self._index()
+        with self._lock:
+            db.execute("INSERT OR REPLACE INTO thumbs (src, digest, bytes, used) VALUES (?, ?, ?, ?)",
+                       (f"{self.size}:{src}", digest, len(data), time.time()))
+            db.commit()
+            self._evict(db)
+        return digest
+
+    def _evict(self, db: sqlite3.Connection):
+        # least recently used files first, down to 90% so we don't evict on every store
+        total = db.execute("SELECT COALESCE(SUM(b), 0) FROM (SELECT MAX(bytes) AS b FROM thumbs GROUP BY digest)").fetchone()[0]
+        if total <= self.max_bytes: return
+        for digest, b in db.execute("SELECT digest, MAX(bytes) FROM thumbs GROUP BY digest ORDER BY MAX(used)").fetchall():
+            if total <= self.max_bytes * 0.9: break
+            db.execute("DELETE FROM thumbs WHERE digest = ?", (digest,))
+            try: os.remove(self._path(digest))
+            except FileNotFoundError: pass
+            total -= b
+            self.counts["evicted"] += 1
+        db.commit()
+
+    def _session(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=True, max_redirects=3)
+            self._loop = loop
+        return self._client
+
+    async def get(self, src: str) -> Tuple[str, bytes]:
+        # (digest, WebP bytes); the first request for a picture fetches it, concurrent ones wait for that
+        # the index is SQLite shared with other workers, so it is read and written off the event loop
+        hit = await asyncio.to_thread(self.lookup, src)
+        if hit is not None:
+            self.counts["hit"] += 1
+            THUMB_REQUESTS.inc("hit")
+            return hit
+        try:
+            return await self.flight.do(src, lambda: self._fetch(src))
+        except ThumbError:
+            self.counts["failed"] += 1
+            THUMB_REQUESTS.inc("failed")
+            raise
+
+    async def _fetch(self, src: str) -> Tuple[str, bytes]:
+        buf = bytearray()
+        try:
+            async with self._session().stream("GET", src) as r:
+                if r.status_code != 200: raise ThumbError(502, f"Afbeelding niet beschikbaar ({r.status_code}).")
+                async for chunk in r.aiter_bytes():
+                    buf += chunk
+                    if len(buf) > MAX_SOURCE_BYTES: raise ThumbError(422, "Afbeelding is te groot.")
+        except httpx.HTTPError:
+            raise ThumbError(502, "Afbeelding niet bereikbaar.")
+        data = await asyncio.to_thread(_render, bytes(buf), self.size, self.quality)
+        digest = await asyncio.to_thread(self.store, src, data)
+        self.counts["fetched"] += 1
+        THUMB_REQUESTS.inc("fetched")
+        return digest, data
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self.counts, enabled=ENABLED, size=self.size, max_bytes=self.max_bytes)
+        if self._db is not None:
+            with self._lock:
+                out["files"], out["bytes"] = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(b), 0) FROM (SELECT MAX(bytes) AS b FROM thumbs GROUP BY digest)").fetchone()
+        return out
+
+THUMBS = ThumbCache()
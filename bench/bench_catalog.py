@@ -0,0 +1,77 @@
+"""Linear demo-search scan vs the indexed Catalog (in memory and memory-mapped) on a synthetic catalog.
+
+    python bench/bench_catalog.py --items 500000 --queries 200
+"""
+import argparse, os, random, sys, tempfile, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from catalog import Catalog, MappedCatalog, write_catalog
+from style_presets import DEFAULT_PALETTES, STYLE_KEYWORDS
+
+CATEGORIES = ["outer", "top1", "top2", "bottom", "shoes", "tee", "accessory"]
+GENDERS = ["male", "female", "unisex"]
+STYLES = list(STYLE_KEYWORDS)
+COLORS = sorted({c for p in DEFAULT_PALETTES.values() for c in p} | {"olive", "cognac", "sage", "rust"})
+
+def synthetic(n: int, seed: int = 7):
+    rnd = random.Random(seed)
+    return [{
+        "category": rnd.choice(CATEGORIES),
+        "title": f"item {i}",
+        "price": round(rnd.uniform(5, 250), 2),
+        "currency": "EUR", "link": "#", "source": "bench", "thumbnail": None,
+        "gender": rnd.choice(GENDERS),
+        "styles": rnd.sample(STYLES, rnd.randint(1, 2)),
+        "color": rnd.choice(COLORS),
+    } for i in range(n)]
+
+def linear(items, category, gender, styles, colors):
+    # the pre-index _demo_search loop
+    colors = set([c.lower() for c in colors])
+    results = []
+    for item in items:
+        if item["category"] != category: continue
+        if item["gender"] not in ("unisex", gender): continue
+        if styles and len(set(item.get("styles", [])) & set(styles)) == 0: continue
+        if item.get("color", "").lower() not in colors: continue
+        results.append(item)
+    return results
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=500_000)
+    ap.add_argument("--queries", type=int, default=200)
+    a = ap.parse_args()
+    items = synthetic(a.items)
+    t0 = time.perf_counter(); cat = Catalog(items); build = time.perf_counter() - t0
+    rnd = random.Random(1)
+    qs = [(rnd.choice(CATEGORIES), rnd.choice(GENDERS[:2]), rnd.sample(STYLES, 2),
+           DEFAULT_PALETTES[rnd.choice(STYLES)], rnd.uniform(10, 80)) for _ in range(a.queries)]
+
+    n_lin = max(1, a.queries // 20)  # the scan is slow; sample it
+    t0 = time.perf_counter()
+    for c, g, s, col, _ in qs[:n_lin]: linear(items, c, g, s, col)
+    lin = (time.perf_counter() - t0) / n_lin
+    t0 = time.perf_counter()
+    for c, g, s, col, _ in qs: cat.search(c, g, s, col)
+    full = (time.perf_counter() - t0) / len(qs)
+    t0 = time.perf_counter()
+    for c, g, s, col, cap in qs: cat.search(c, g, s, col, price_cap=cap)
+    capped = (time.perf_counter() - t0) / len(qs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.annacat")
+        t0 = time.perf_counter(); write_catalog(items, path); written = time.perf_counter() - t0
+        t0 = time.perf_counter(); mapped = MappedCatalog(path); opened = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for c, g, s, col, cap in qs: mapped.search(c, g, s, col, price_cap=cap)
+        mcapped = (time.perf_counter() - t0) / len(qs)
+        size = os.path.getsize(path)
+        mapped.close()
+
+    print(f"catalog: {a.items} items, index build {build:.2f} s")
+    print(f"linear scan          {lin*1000:9.3f} ms/query")
+    print(f"index, all matches   {full*1000:9.3f} ms/query  ({lin/full:.1f}x)")
+    print(f"index, price_cap     {capped*1000:9.3f} ms/query  ({lin/capped:.1f}x)")
+    print(f"mapped file: {size/1e6:.1f} MB, write {written:.2f} s, open {opened*1000:.1f} ms")
+    print(f"mapped, price_cap    {mcapped*1000:9.3f} ms/query  ({lin/mcapped:.1f}x)")
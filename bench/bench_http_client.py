@@ -0,0 +1,44 @@
+"""A new httpx client per call vs the pooled AsyncSerpClient against the fake upstream.
+
+    python bench/bench_http_client.py --calls 200
+    # TLS (handshake cost dominates): generate a self-signed cert for 127.0.0.1, then
+    SSL_CERT_FILE=cert.pem python bench/bench_http_client.py --certfile cert.pem --keyfile key.pem
+"""
+import argparse, asyncio, os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import httpx
+import fake_serpapi
+from serp_client import AsyncSerpClient
+
+async def _run(label, fn, calls):
+    t0 = time.perf_counter()
+    for i in range(calls):
+        await fn({"engine": "google_shopping", "q": f"men casual jeans {i}", "gl": "nl", "num": 4})
+    dt = time.perf_counter() - t0
+    print(f"{label:<16} {calls} calls  {dt*1000:8.1f} ms  {dt/calls*1000:6.2f} ms/call")
+    return dt
+
+async def main(url, calls):
+    async def naive(params):
+        async with httpx.AsyncClient(timeout=20) as c:
+            r = await c.get(url, params=params)
+            r.raise_for_status()
+            return r.json()
+
+    pooled = AsyncSerpClient(url=url)
+    try:
+        slow = await _run("client per call", naive, calls)
+        fast = await _run("pooled client", pooled.get, calls)
+    finally:
+        await pooled.aclose()
+    print(f"speedup {slow/fast:.2f}x")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--certfile"); ap.add_argument("--keyfile")
+    a = ap.parse_args()
+    srv = fake_serpapi.start(certfile=a.certfile, keyfile=a.keyfile)
+    asyncio.run(main(srv.url, a.calls))
+    srv.shutdown()
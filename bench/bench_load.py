@@ -0,0 +1,91 @@
+"""Load driver: latency percentiles and throughput of a whole generation (pipeline.generate)
+at several concurrency levels, per search backend: serpapi (against fake_serpapi, started
+in-process unless --upstream is given), demo (offline catalog, no network) and fixture
+(a --record'ed session, no network).
+
+    python bench/bench_load.py --concurrency 1,8,32 --requests 200 --latency-ms 150 --out load.json
+    python bench/bench_load.py --target demo --concurrency 1,4
+    python bench/bench_load.py --target fixture --fixture recorded.jsonl
+"""
+import argparse, asyncio, math, os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import fake_serpapi
+from report import save
+
+def intake(i: int, warm: bool) -> dict:
+    # a distinct color per request keeps every search a cache miss unless --warm
+    colors = ["navy"] if warm else [f"kleur{i}"]
+    return {"purpose": "werk", "styles": ["casual"], "gender": "male", "country": "NL", "budget_total": 250,
+            "favorite_colors": colors, "currency": "EUR", "fit": None, "accessibility": None}
+
+def pct(sorted_vals: list, p: float) -> float:
+    return sorted_vals[max(0, math.ceil(p / 100 * len(sorted_vals)) - 1)]
+
+def summarize(name: str, lat: list, errors: int, wall: float, concurrency: int) -> dict:
+    lat.sort()
+    row = {"name": name, "concurrency": concurrency, "requests": len(lat) + errors, "ok": len(lat), "errors": errors,
+           "rps": round(len(lat) / wall, 2) if wall else 0.0}
+    for p in (50, 95, 99):
+        row[f"p{p}_ms"] = round(pct(lat, p) * 1000, 1) if lat else None
+    print(f"{name:<24} c={concurrency:<4} {row['rps']:>8.1f} req/s  p50 {row['p50_ms']} ms  "
+          f"p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms  errors {errors}")
+    return row
+
+async def load(generate, backend, concurrency: int, n: int, offset: int, warm: bool) -> dict:
+    lat, errors, nxt = [], 0, iter(range(n))
+    async def worker():
+        nonlocal errors
+        for i in nxt:
+            t0 = time.perf_counter()
+            try:
+                await generate(intake(offset + i, warm), backend, 3)
+                lat.append(time.perf_counter() - t0)
+            except Exception:
+                errors += 1
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(f"generate[{backend.name}]", lat, errors, time.perf_counter() - t0, concurrency)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--target", choices=["serpapi", "demo", "fixture", "both"], default="both", help="both = serpapi and demo")
+    ap.add_argument("--concurrency", default="1,8,32", help="comma-separated levels")
+    ap.add_argument("--requests", type=int, default=100, help="requests per level")
+    ap.add_argument("--latency-ms", type=float, default=150)
+    ap.add_argument("--jitter-ms", type=float, default=50)
+    ap.add_argument("--error-rate", type=float, default=0)
+    ap.add_argument("--replay", help="JSONL recording for the fake upstream")
+    ap.add_argument("--fixture", help="JSONL recording for --target fixture")
+    ap.add_argument("--upstream", help="use an already running SerpAPI stand-in at this URL")
+    ap.add_argument("--warm", action="store_true", help="repeat one intake so searches hit the cache")
+    ap.add_argument("--out", help="write results as JSON")
+    a = ap.parse_args()
+    levels = [int(c) for c in a.concurrency.split(",")]
+
+    if a.target in ("serpapi", "both") and not a.upstream:
+        srv = fake_serpapi.start(latency=a.latency_ms / 1000, jitter=a.jitter_ms / 1000,
+                                 error_rate=a.error_rate, replay=a.replay)
+        a.upstream = srv.url
+    if a.upstream: os.environ["SERPAPI_URL"] = a.upstream
+    os.environ.setdefault("SERP_POOL_SIZE", str(max(levels) * 8))
+    import pipeline, search_backends  # read SERPAPI_URL at import
+    backends = {"serpapi": [search_backends.SerpApiBackend("bench")], "demo": [search_backends.CatalogBackend()],
+                "both": [search_backends.SerpApiBackend("bench"), search_backends.CatalogBackend()]}.get(a.target)
+    if a.target == "fixture":
+        if not a.fixture: ap.error("--target fixture needs --fixture")
+        backends = [search_backends.FixtureBackend(a.fixture)]
+    async def run():
+        out = []
+        for backend in backends:
+            for k, c in enumerate(levels):
+                search_backends.SERP_CACHE.clear()
+                out.append(await load(pipeline.generate, backend, c, a.requests, k * a.requests, a.warm))
+        return out
+    rows = asyncio.run(run())
+    for row in rows:
+        row["name"] = f"{row['name']}@c{row['concurrency']}"
+    if a.out:
+        save(a.out, "load", rows, levels=levels, requests=a.requests, latency_ms=a.latency_ms, jitter_ms=a.jitter_ms,
+             error_rate=a.error_rate, warm=a.warm, upstream=a.upstream, replay=a.replay, fixture=a.fixture)
+        print(f"wrote {a.out}")
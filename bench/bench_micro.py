@@ -0,0 +1,92 @@
+"""Microbenchmarks for the per-request hot helpers.
+
+    python bench/bench_micro.py --out micro.json
+"""
+import argparse, asyncio, gzip, json, os, random, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import outfit_engine
+import payload
+import pipeline
+import search_backends
+from report import save
+
+INTAKE = {"purpose": "werk", "styles": ["casual", "minimalistisch"], "gender": "male", "country": "NL",
+          "budget_total": 250, "favorite_colors": ["navy", "wit"]}
+
+LINKS = [
+    "https://www.zalando.nl/heren-overshirt-navy.html?utm_source=google&utm_medium=cpc&gclid=abc123&size=M",
+    "//www2.hm.com/nl_nl/productpage.0970819001.html",
+    "www.wehkamp.nl/heren-chino-blauw-16432075/?fbclid=xyz",
+    "https://www.aboutyou.nl/p/selected-homme/chino-1234567",
+    None,
+]
+
+def results(n: int, rnd: random.Random):
+    out = []
+    for i in range(n):
+        p = round(rnd.uniform(5, 250), 2)
+        r = {"title": f"r{i}", "price": f"€{p:.2f}".replace(".", ","), "source": "Zalando.nl"}
+        if rnd.random() < 0.9: r["extracted_price"] = p
+        out.append(r)
+    return out
+
+def measure(name: str, fn, min_time: float, repeats: int) -> dict:
+    # calls per batch sized so one batch takes about min_time; best of `repeats` batches
+    n = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(n): fn()
+        if time.perf_counter() - t0 >= min_time / 10: break
+        n *= 2
+    n = max(1, int(n * min_time / max(time.perf_counter() - t0, 1e-9) / 10))
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for _ in range(n): fn()
+        best = min(best, (time.perf_counter() - t0) / n)
+    return {"name": name, "us_per_op": round(best * 1e6, 3), "ops_per_s": round(1 / best), "loops": n}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--min-time", type=float, default=0.2, help="seconds per timed batch")
+    ap.add_argument("--repeats", type=int, default=5)
+    ap.add_argument("--results", type=int, default=40, help="search results per list (google_shopping returns up to ~40)")
+    ap.add_argument("--out", help="write results as JSON")
+    a = ap.parse_args()
+    rnd = random.Random(5)
+    rs = results(a.results, rnd)
+    serp = search_backends.SerpApiBackend("bench")
+    plan = pipeline._plan(INTAKE, serp, 3)
+    styles = outfit_engine._normalize_styles(INTAKE["styles"])
+    colors = outfit_engine._pick_palette(styles, INTAKE["favorite_colors"])["colors"]
+    # every category picking from its own list of a.results search results
+    queries = {cat: (cat,) for cat in pipeline.CATEGORIES}
+    found = {cat: results(a.results, rnd) for cat in pipeline.CATEGORIES}
+    cands = [(pipeline._price_of(r), r) for r in rs]
+    best = min(cands, key=lambda c: abs(c[0] - 62.5))
+    result = asyncio.run(pipeline.generate(INTAKE, search_backends.CatalogBackend(), 3))
+    sizes = {fmt: len(body) for fmt, body in (("full", payload.dumps(result)), ("compact", payload.dumps(payload.compact(result))))}
+    sizes.update({f"{fmt}_gzip": len(gzip.compress(payload.dumps(v), 6)) for fmt, v in (("full", result), ("compact", payload.compact(result)))})
+
+    cases = [
+        ("SerpApiBackend.queries", lambda: serp.queries("outer", INTAKE, plan)),
+        (f"pipeline._select[7x{a.results}]", lambda: pipeline._select(plan, queries, found)),
+        (f"pipeline._cheaper[{a.results}]", lambda: pipeline._cheaper(cands, 62.5, best[1], best[0])),
+        (f"search_backends._normalize_link[x{len(LINKS)}]", lambda: [search_backends._normalize_link(u, "chino", "Zalando") for u in LINKS]),
+        ("Catalog.search", lambda: outfit_engine.DEMO_CATALOG.search("outer", "male", styles, colors, price_cap=62.5)),
+        ("Catalog.search[nocap]", lambda: outfit_engine.DEMO_CATALOG.search("outer", "male", styles, colors)),
+        # a whole /api/generate body: the stdlib encoder it used to go through, for reference
+        ("json.dumps[result]", lambda: json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode("utf-8")),
+        ("payload.dumps[result]", lambda: payload.dumps(result)),
+        ("payload.compact[result]", lambda: payload.compact(result)),
+    ]
+    rows = []
+    for name, fn in cases:
+        row = measure(name, fn, a.min_time, a.repeats)
+        rows.append(row)
+        print(f"{name:<40} {row['us_per_op']:>10.2f} us/op  {row['ops_per_s']:>10} ops/s")
+    print("payload bytes: " + ", ".join(f"{k} {v}" for k, v in sizes.items()))
+    if a.out:
+        save(a.out, "micro", rows, results=a.results, catalog_items=len(outfit_engine.DEMO_CATALOG), payload_bytes=sizes)
+        print(f"wrote {a.out}")
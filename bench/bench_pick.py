@@ -0,0 +1,47 @@
+"""The pick stage on large result lists: one price parse per result, the whole-outfit
+beam search (optimizer.best_outfits) and the cheaper alternatives, as pipeline._select
+runs them for every generation.
+
+    python bench/bench_pick.py --results 100000 --rounds 20
+"""
+import argparse, os, random, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import pipeline, search_backends
+
+INTAKE = {"purpose": "werk", "styles": ["casual"], "gender": "male", "country": "NL", "budget_total": 250}
+
+def results(n, rnd):
+    out = []
+    for i in range(n):
+        # like google_shopping: a display price, usually with extracted_price next to it
+        p = round(rnd.uniform(3, 300), rnd.choice([0, 2]))
+        r = {"title": f"r{i}", "price": f"€{p:.2f}".replace(".", ",")}
+        if rnd.random() < 0.9: r["extracted_price"] = p
+        out.append(r)
+    return out
+
+def timed(fn, rounds):
+    t0 = time.perf_counter()
+    for _ in range(rounds): fn()
+    return (time.perf_counter() - t0) / rounds
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--results", type=int, default=100_000, help="results per category")
+    ap.add_argument("--rounds", type=int, default=10)
+    a = ap.parse_args()
+    rnd = random.Random(3)
+    plan = pipeline._plan(INTAKE, search_backends.CatalogBackend(), 3)
+    queries = {cat: (cat,) for cat in pipeline.CATEGORIES}
+    found = {cat: results(a.results, rnd) for cat in pipeline.CATEGORIES}
+    picks, cheaper = pipeline._select(plan, queries, found)
+    # an alternative is always cheaper than its pick
+    for slot, alt in cheaper.items():
+        assert pipeline._price_of(alt) <= pipeline._price_of(picks[slot]) * 0.85
+    cands = [(pipeline._price_of(r), r) for r in found["outer"]]
+    best = picks[(0, "outer")]
+    for label, fn in (("_price_of", lambda: [(pipeline._price_of(r), r) for r in found["outer"]]),
+                      ("_select", lambda: pipeline._select(plan, queries, found)),
+                      ("_cheaper", lambda: pipeline._cheaper(cands, plan["alloc"]["outer"], best, pipeline._price_of(best)))):
+        print(f"{label:<10} {a.results} results/category  {timed(fn, a.rounds)*1000:8.2f} ms")
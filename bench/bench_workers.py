@@ -0,0 +1,113 @@
+"""Multi-worker scaling: `main.py serve --workers N` (shared SQLite state) against plain
+`uvicorn --workers N` (every worker its own in-memory caches), for N = 1..8, both against
+fake_serpapi. Requests cycle through --intakes distinct intakes, so a lookup one worker
+made is worth something to the others only when the state is shared. The response cache
+is switched off, so every request runs the pipeline and the SerpAPI cache does the work.
+
+    python bench/bench_workers.py --workers 1,2,4,8 --requests 400 --out workers.json
+"""
+import argparse, asyncio, os, shutil, socket, subprocess, sys, tempfile, time
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND)
+
+import httpx
+import fake_serpapi
+from bench_load import pct
+from report import save
+
+COLORS = ["navy", "wit", "olijf", "zwart", "grijs", "beige", "bordeaux", "camel", "denim", "groen"]
+
+def intake(i: int) -> dict:
+    return {"purpose": "werk", "styles": ["casual"], "gender": ["male", "female"][i % 2], "country": "NL",
+            "budget_total": 250, "favorite_colors": [COLORS[i // 2 % len(COLORS)]]}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def launch(mode: str, workers: int, port: int, upstream: str, state_dir: str) -> subprocess.Popen:
+    env = dict(os.environ, SERPAPI_URL=upstream, SERPAPI_API_KEY="bench", RESPONSE_CACHE_TTL="0", RESPONSE_CACHE_STALE="0",
+               THUMB_PROXY="0", ANNA_STATE_DIR="")
+    for k in ("SERP_CACHE_DB", "LINK_INDEX_DB", "QUOTA_DB"): env.pop(k, None)
+    if mode == "shared":
+        cmd = [sys.executable, "main.py", "serve", "--workers", str(workers), "--port", str(port), "--state-dir", state_dir]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(workers), "--port", str(port)]
+    return subprocess.Popen(cmd + ["--host", "127.0.0.1"], cwd=BACKEND, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def ready(base: str, workers: int, timeout: float = 60):
+    # a run of successes in a row, so the later workers are up too
+    deadline, streak = time.time() + timeout, 0
+    async with httpx.AsyncClient() as c:
+        while streak < 4 * workers:
+            if time.time() > deadline: raise SystemExit(f"server on {base} did not come up")
+            try:
+                streak = streak + 1 if (await c.get(base + "/api/meta")).status_code == 200 else 0
+            except httpx.HTTPError:
+                streak = 0
+                await asyncio.sleep(0.2)
+    await asyncio.sleep(0.5)
+
+async def drive(base: str, n: int, concurrency: int, distinct: int) -> dict:
+    lat, errors, lookups, upstream, nxt = [], 0, 0, 0, iter(range(n))
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=concurrency)) as c:
+        async def worker():
+            nonlocal errors, lookups, upstream
+            for i in nxt:
+                t0 = time.perf_counter()
+                try:
+                    r = await c.post(base + "/api/generate", json={"intake": intake(i % distinct), "mode": "serpapi"})
+                    r.raise_for_status()
+                    usage = r.json().get("usage") or {}
+                    lat.append(time.perf_counter() - t0)
+                    lookups += usage.get("lookups", 0)
+                    upstream += usage.get("upstream_calls", 0)
+                except httpx.HTTPError:
+                    errors += 1
+        t0 = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - t0
+    lat.sort()
+    return {"ok": len(lat), "errors": errors, "rps": round(len(lat) / wall, 2), "lookups": lookups, "billed": upstream,
+            "p50_ms": round(pct(lat, 50) * 1000, 1) if lat else None, "p95_ms": round(pct(lat, 95) * 1000, 1) if lat else None}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts")
+    ap.add_argument("--modes", default="shared,isolated")
+    ap.add_argument("--requests", type=int, default=400, help="requests per run")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--intakes", type=int, default=20, help="distinct intakes the requests cycle through")
+    ap.add_argument("--latency-ms", type=float, default=100)
+    ap.add_argument("--jitter-ms", type=float, default=20)
+    ap.add_argument("--out", help="write results as JSON")
+    a = ap.parse_args()
+    srv = fake_serpapi.start(latency=a.latency_ms / 1000, jitter=a.jitter_ms / 1000)
+    rows = []
+    for mode in a.modes.split(","):
+        for workers in [int(w) for w in a.workers.split(",")]:
+            state_dir, port = tempfile.mkdtemp(prefix="anna-bench-"), free_port()
+            proc = launch(mode, workers, port, srv.url, state_dir)
+            base = f"http://127.0.0.1:{port}"
+            try:
+                asyncio.run(ready(base, workers))
+                srv.hits.clear(); srv.calls.clear()
+                row = asyncio.run(drive(base, a.requests, a.concurrency, a.intakes))
+            finally:
+                proc.terminate()
+                proc.wait(30)
+                shutil.rmtree(state_dir, ignore_errors=True)
+            # hit rate from what actually reached the upstream: concurrent misses that were
+            # coalesced into one call are each billed in their request's usage
+            upstream = sum(srv.hits.values())
+            row.update(name=f"{mode}@w{workers}", mode=mode, workers=workers, upstream=upstream,
+                       hit_rate=round(1 - upstream / row["lookups"], 4) if row["lookups"] else 0.0)
+            rows.append(row)
+            print(f"{row['name']:<14} {row['rps']:>8.1f} req/s  p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  "
+                  f"hit rate {row['hit_rate']:.1%}  upstream {row['upstream']}  errors {row['errors']}")
+    if a.out:
+        save(a.out, "workers", rows, requests=a.requests, concurrency=a.concurrency, intakes=a.intakes,
+             latency_ms=a.latency_ms, jitter_ms=a.jitter_ms)
+        print(f"wrote {a.out}")
@@ -0,0 +1,169 @@
+"""Local stand-in for serpapi.com/search.json.
+
+Serves google_shopping / google_shopping_product / google payloads with
+configurable latency and error rate. Point the backend at it with
+SERPAPI_URL=http://127.0.0.1:<port>/search.json.
+
+Payloads are synthetic unless a recording is given with --replay: a JSONL file
+of {"params": {...}, "response": {...}} lines. A request whose params (minus
+api_key) match a recorded line gets that response; otherwise it gets a recorded
+response of the same engine, chosen by hashing the params. Record one against
+the real API with --record: requests are forwarded with their own api_key.
+
+    python bench/fake_serpapi.py --port 8765 --latency-ms 150 --error-rate 0.05
+    python bench/fake_serpapi.py --record recorded.jsonl      # proxy to serpapi.com and save
+    python bench/fake_serpapi.py --replay recorded.jsonl --latency-ms 150
+"""
+import argparse, json, random, ssl, threading, time, zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode, urlparse, parse_qs
+from urllib.request import urlopen
+
+SERPAPI_URL = "https://serpapi.com/search.json"
+
+def _shopping(q: str, num: int):
+    seed = zlib.crc32(q.encode())
+    rnd = random.Random(seed)
+    out = []
+    for i in range(num):
+        pid = str(seed % 10**8 * 100 + i)
+        price = round(rnd.uniform(8, 180), 2)
+        out.append({
+            "position": i + 1,
+            "title": f"{q} #{i}",
+            "product_id": pid,
+            "link": f"https://www.google.com/shopping/product/{pid}",
+            "source": rnd.choice(["Zalando.nl", "H&M", "About You", "Wehkamp"]),
+            "price": f"€{price:.2f}".replace(".", ","),
+            "extracted_price": price,
+            "thumbnail": f"https://encrypted-tbn0.gstatic.com/shopping?q=tbn:{pid}",
+        })
+    return {"shopping_results": out}
+
+def _product(pid: str):
+    return {"sellers_results": [
+        {"source": "Zalando.nl", "link": f"https://www.zalando.nl/p/{pid}.html"},
+        {"source": "H&M", "link": f"https://www2.hm.com/nl_nl/productpage.{pid}.html"},
+    ]}
+
+def _web(q: str, num: int):
+    slug = "-".join(q.lower().split())[:60]
+    return {"organic_results": [{"position": i + 1, "link": f"https://www.zalando.nl/{slug}-{i}.html"} for i in range(num)]}
+
+def _key(params: dict) -> str:
+    return json.dumps({k: v for k, v in params.items() if k != "api_key"}, sort_keys=True)
+
+class Recording:
+    def __init__(self, path: str):
+        self.exact, self.by_engine = {}, {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip(): continue
+                rec = json.loads(line)
+                params = {k: str(v) for k, v in rec["params"].items()}
+                self.exact[_key(params)] = rec["response"]
+                self.by_engine.setdefault(params.get("engine", ""), []).append(rec["response"])
+
+    def lookup(self, params: dict):
+        hit = self.exact.get(_key(params))
+        if hit is not None: return hit
+        pool = self.by_engine.get(params.get("engine", ""))
+        return pool[zlib.crc32(_key(params).encode()) % len(pool)] if pool else None
+
+class FakeSerpApi(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, latency: float = 0.0, error_rate: float = 0.0, jitter: float = 0.0,
+                 replay: str = None, record: str = None, upstream: str = SERPAPI_URL):
+        super().__init__(addr, _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.recording = Recording(replay) if replay else None
+        self.record_to = open(record, "a", encoding="utf-8") if record else None
+        self.upstream = upstream
+        self.hits = {}   # engine -> requests
+        self.calls = {}  # params minus api_key -> requests, to spot a lookup made twice
+        self._lock = threading.Lock()
+
+    def save(self, params: dict, body: dict):
+        with self._lock:
+            self.record_to.write(json.dumps({"params": {k: v for k, v in params.items() if k != "api_key"},
+                                             "response": body}, ensure_ascii=False) + "\n")
+            self.record_to.flush()
+
+    def count(self, params: dict):
+        engine, key = params.get("engine", ""), _key(params)
+        with self._lock:
+            self.hits[engine] = self.hits.get(engine, 0) + 1
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    @property
+    def url(self) -> str:
+        scheme = "https" if isinstance(self.socket, ssl.SSLSocket) else "http"
+        return f"{scheme}://127.0.0.1:{self.server_address[1]}/search.json"
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real upstream
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        p = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        engine = p.get("engine", "")
+        srv = self.server
+        srv.count(p)
+        if srv.record_to:
+            with urlopen(f"{srv.upstream}?{urlencode(p)}", timeout=30) as r:
+                body = json.loads(r.read())
+            srv.save(p, body)
+            return self._send(200, body)
+        if srv.latency or srv.jitter: time.sleep(max(0.0, srv.latency + random.uniform(-srv.jitter, srv.jitter)))
+        if random.random() < srv.error_rate:
+            return self._send(503, {"error": "fake upstream error"})
+        body = srv.recording.lookup(p) if srv.recording else None
+        if body is not None: return self._send(200, body)
+        num = int(p.get("num") or 10)
+        if engine == "google_shopping": body = _shopping(p.get("q", ""), num)
+        elif engine == "google_shopping_product": body = _product(p.get("product_id", ""))
+        elif engine == "google": body = _web(p.get("q", ""), num)
+        else: return self._send(400, {"error": f"unknown engine {engine!r}"})
+        self._send(200, body)
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def start(port: int = 0, latency: float = 0.0, error_rate: float = 0.0, certfile: str = None, keyfile: str = None,
+          jitter: float = 0.0, replay: str = None, record: str = None) -> FakeSerpApi:
+    srv = FakeSerpApi(("127.0.0.1", port), latency=latency, error_rate=error_rate, jitter=jitter, replay=replay, record=record)
+    if certfile:
+        ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ctx.load_cert_chain(certfile, keyfile)
+        srv.socket = ctx.wrap_socket(srv.socket, server_side=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=0)
+    ap.add_argument("--jitter-ms", type=float, default=0, help="uniform ± on top of --latency-ms")
+    ap.add_argument("--error-rate", type=float, default=0)
+    ap.add_argument("--replay", help="JSONL recording to serve instead of synthetic payloads")
+    ap.add_argument("--record", help="proxy to serpapi.com and append every response to this JSONL file")
+    ap.add_argument("--certfile"); ap.add_argument("--keyfile")
+    a = ap.parse_args()
+    srv = start(a.port, a.latency_ms / 1000, a.error_rate, a.certfile, a.keyfile,
+                jitter=a.jitter_ms / 1000, replay=a.replay, record=a.record)
+    print(f"fake SerpAPI on {srv.url}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,60 @@
+"""JSON results for the bench scripts, and a diff of two result files.
+
+    python bench/report.py old.json new.json [--threshold 10]
+
+Rows are matched on their "name"; the timing and throughput fields are compared
+and changes beyond the threshold (percent) are listed, regressions flagged.
+"""
+import argparse, json, math, os, platform, subprocess, sys, time
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def save(path: str, bench: str, rows: list, **params):
+    doc = {
+        "bench": bench,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} cpu)",
+        "params": params,
+        "rows": rows,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2)
+        f.write("\n")
+
+# compared fields: +1 when higher is better, -1 when lower is better
+METRICS = {"us_per_op": -1, "rps": +1, "p50_ms": -1, "p95_ms": -1, "p99_ms": -1, "errors": -1}
+
+def diff(old: dict, new: dict, threshold: float) -> int:
+    before = {r["name"]: r for r in old["rows"]}
+    worse = 0
+    print(f"{old.get('commit') or '?'} -> {new.get('commit') or '?'}")
+    for row in new["rows"]:
+        prev = before.get(row["name"])
+        if prev is None:
+            print(f"  {row['name']}: new")
+            continue
+        for k, sign in METRICS.items():
+            v = row.get(k)
+            if not isinstance(v, (int, float)) or not isinstance(prev.get(k), (int, float)) or v == prev[k]: continue
+            change = (v - prev[k]) / prev[k] * 100 if prev[k] else math.copysign(math.inf, v)
+            if abs(change) < threshold: continue
+            bad = change * sign < 0
+            worse += bad
+            print(f"  {row['name']:<40} {k:<10} {prev[k]:>12.4g} -> {v:<12.4g} {change:+6.1f}%{'  REGRESSION' if bad else ''}")
+    return worse
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Compare two bench result files.")
+    ap.add_argument("old"); ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=10.0, help="percent change worth reporting")
+    a = ap.parse_args()
+    with open(a.old) as f: old = json.load(f)
+    with open(a.new) as f: new = json.load(f)
+    sys.exit(1 if diff(old, new, a.threshold) else 0)
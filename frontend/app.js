@@ -19,10 +19,13 @@ const state = {
     materials_avoid: [],
     accessibility: {},
     sustainability_preference: false,
-    currency: "EUR"
+    currency: null  // volgt het land
   },
   apiBase: localStorage.getItem("apiBase") || "https://anna-mvp.onrender.com",
   hasSerpEnv: false, // alleen voor info
+  seen: {},          // request body → {etag, data}: bij 304 tonen we het vorige resultaat opnieuw
+  session: null,     // sessie van de laatste generatie: budget/aantal aanpassen zonder opnieuw te zoeken
+  outfitsCount: 3,
 };
 
 const BUBBLE = qs("#bubbleTemplate").content.firstElementChild;
@@ -170,41 +173,128 @@ function parseInput(text){
       else addBubble("Geen probleem. Zeg het als je klaar bent met <strong>ja</strong>.");
       break;
 
-    default:
+    default: {
       addUser(text);
+      const budget = t.match(/^(?:budget\s*)?€?\s*(\d+(?:[.,]\d+)?)$/i);
+      const count = t.match(/^(\d)\s*outfits?$/i);
+      if(budget) adjustOutfits({budget_total: parseFloat(budget[1].replace(",", "."))});
+      else if(count) adjustOutfits({outfits_count: parseInt(count[1], 10)});
+    }
   }
 }
 
 async function generateOutfits(){
   addBubble("Top — ik ga voor je aan de slag ✅ Een momentje…");
+  const body = JSON.stringify({
+    intake: state.intake,
+    mode: "serpapi",       // altijd LIVE
+    serpapi_api_key: null, // sleutel staat server-side
+    outfits_count: state.outfitsCount,
+    format: "compact"      // items één keer, outfits verwijzen ernaar (zie expand)
+  });
+  const prev = state.seen[body];
+  const headers = {"Content-Type":"application/json"};
+  if(prev) headers["If-None-Match"] = prev.etag;
+  const remember = (etag, data, session) => {
+    if(etag) state.seen[body] = {etag, data};
+    if(session) state.session = session;
+  };
   try{
-    const res = await fetch(state.apiBase + "/api/generate", {
-      method: "POST",
-      headers: {"Content-Type":"application/json"},
-      body: JSON.stringify({
-        intake: state.intake,
-        mode: "serpapi",       // altijd LIVE
-        serpapi_api_key: null, // sleutel staat server-side
-        outfits_count: 3
-      })
-    });
-    if(!res.ok){
-      const err = await res.json().catch(()=>({detail: res.statusText}));
+    const res = await fetch(state.apiBase + "/api/generate/stream", {method: "POST", headers, body});
+    state.session = res.headers.get("X-Session") || state.session;
+    if(res.status === 304 && prev){
+      renderOutfits(prev.data, "live via SerpAPI");
+      return;
+    }
+    if(res.ok && res.body && res.body.getReader){
+      await renderStream(res.body.getReader(), "live via SerpAPI", remember);
+      return;
+    }
+    // Oudere server of browser zonder streams: val terug op het volledige antwoord
+    const full = await fetch(state.apiBase + "/api/generate", {method: "POST", headers, body});
+    if(full.status === 304 && prev){
+      renderOutfits(prev.data, "live via SerpAPI");
+      return;
+    }
+    if(!full.ok){
+      const err = await full.json().catch(()=>({detail: full.statusText}));
       throw new Error(err.detail || "Onbekende fout");
     }
-    const data = await res.json();
+    const data = await full.json();
+    remember(full.headers.get("ETag"), data, full.headers.get("X-Session"));
     renderOutfits(data, "live via SerpAPI");
   }catch(e){
     addBubble("Hm, dat ging mis. Probeer later opnieuw.", "anna");
   }
 }
 
-function renderOutfits(data, modeLabel="live"){
+// Alleen budget of aantal outfits anders: de server hergebruikt de zoekresultaten van de sessie
+async function adjustOutfits(changes){
+  if(!state.session) return generateWith(changes);
+  try{
+    const res = await fetch(state.apiBase + "/api/generate/delta", {
+      method: "POST",
+      headers: {"Content-Type":"application/json"},
+      body: JSON.stringify({session: state.session, format: "compact", ...changes})
+    });
+    // sessies leven per worker: verlopen, of dit verzoek kwam op een andere worker terecht
+    if(res.status === 404){ state.session = null; return generateWith(changes); }
+    if(!res.ok) throw new Error(res.statusText);
+    applyChanges(changes);
+    renderOutfits(await res.json(), "live via SerpAPI");
+  }catch(e){
+    addBubble("Hm, dat ging mis. Probeer later opnieuw.", "anna");
+  }
+}
+
+function applyChanges(changes){
+  if(changes.budget_total) state.intake.budget_total = changes.budget_total;
+  if(changes.outfits_count) state.outfitsCount = changes.outfits_count;
+}
+
+function generateWith(changes){
+  applyChanges(changes);
+  return generateOutfits();
+}
+
+// NDJSON-stream: plan → items zodra hun link bekend is → totalen → done
+async function renderStream(reader, modeLabel, remember=()=>{}){
+  const decoder = new TextDecoder();
+  let buf = "", view = null;
+  const handle = (ev) => {
+    if(ev.event === "plan"){
+      view = renderShell(ev.outfits_count || 3, modeLabel);
+    }else if(ev.event === "item" && view){
+      const card = view.cards[ev.outfit];
+      if(card) card.insertBefore(makeItemRow(ev.item), card.querySelector(".total"));
+    }else if(ev.event === "outfit" && view){
+      const card = view.cards[ev.outfit];
+      if(card) card.querySelector(".total").innerHTML = `<span class="label">Totaal</span><strong>${formatPrice(ev.total, ev.currency)}</strong>`;
+    }else if(ev.event === "done"){
+      remember(ev.etag, ev.result, ev.session);
+      if(!view) renderOutfits(ev.result, modeLabel);
+      else renderFooter(ev.result);
+    }
+  };
+  while(true){
+    const {value, done} = await reader.read();
+    if(done) break;
+    buf += decoder.decode(value, {stream: true});
+    let nl;
+    while((nl = buf.indexOf("\n")) >= 0){
+      const line = buf.slice(0, nl).trim();
+      buf = buf.slice(nl + 1);
+      if(line) handle(JSON.parse(line));
+    }
+  }
+  if(buf.trim()) handle(JSON.parse(buf));
+}
+
+function renderShell(count, modeLabel){
   const chat = qs("#chat");
   const wrap = document.createElement("div");
   wrap.className = "outfits";
 
-  // Moduslabel
   const badge = document.createElement("div");
   badge.className = "small";
   badge.style.margin = "6px 0 8px 0";
@@ -212,48 +302,76 @@ function renderOutfits(data, modeLabel="live"){
   badge.textContent = `modus: ${modeLabel}`;
   chat.appendChild(badge);
 
-  data.outfits.forEach(out => {
+  const cards = [];
+  for(let n = 0; n < count; n++){
     const card = document.createElement("div");
     card.className = "card";
     const h3 = document.createElement("h3");
-    h3.textContent = out.name;
+    h3.textContent = `Outfit ${n+1}`;
     card.appendChild(h3);
-
-    out.items.forEach(it => {
-      const row = document.createElement("div");
-      row.className = "item";
-      const img = document.createElement("img");
-      img.alt = it.title;
-      img.src = it.image || "data:image/svg+xml;charset=utf-8," + encodeURIComponent(`<svg xmlns='http://www.w3.org/2000/svg' width='64' height='64'><rect width='100%' height='100%' fill='#1f2330'/><text x='50%' y='50%' dominant-baseline='middle' text-anchor='middle' fill='#aab1c7' font-size='10'>item</text></svg>`);
-      const col = document.createElement("div");
-      const title = document.createElement("div");
-      title.innerHTML = `<strong>${escapeHtml(it.title)}</strong> <span class="label">(${it.category})</span>`;
-      const meta = document.createElement("div");
-      meta.className = "small";
-      const merchant = it.merchant ? ` • ${escapeHtml(it.merchant)}` : "";
-      const link = it.link || "#";
-      meta.innerHTML = `${formatPrice(it.price, it.currency)}${merchant} — <a href="${link}" target="_blank" rel="noopener">bekijk</a>`;
-      col.appendChild(title);
-      col.appendChild(meta);
-      row.appendChild(img);
-      row.appendChild(col);
-      card.appendChild(row);
-    });
-
     const total = document.createElement("div");
     total.className = "total";
-    total.innerHTML = `<span class="label">Totaal</span><strong>${formatPrice(out.total, out.currency)}</strong>`;
+    total.innerHTML = `<span class="label">Totaal</span><span class="small">zoeken…</span>`;
     card.appendChild(total);
-
     wrap.appendChild(card);
-  });
-
+    cards.push(card);
+  }
   chat.appendChild(wrap);
   wrap.scrollIntoView({behavior:"smooth", block:"end"});
+  return {wrap, cards};
+}
+
+function makeItemRow(it){
+  const row = document.createElement("div");
+  row.className = "item";
+  const img = document.createElement("img");
+  img.alt = it.title;
+  img.loading = "lazy";
+  // /api/img-links (verkleinde kopie op onze server) staan relatief aan de API
+  img.src = it.image ? (it.image.startsWith("/") ? state.apiBase + it.image : it.image) : "data:image/svg+xml;charset=utf-8," + encodeURIComponent(`<svg xmlns='http://www.w3.org/2000/svg' width='64' height='64'><rect width='100%' height='100%' fill='#1f2330'/><text x='50%' y='50%' dominant-baseline='middle' text-anchor='middle' fill='#aab1c7' font-size='10'>item</text></svg>`);
+  const col = document.createElement("div");
+  const title = document.createElement("div");
+  title.innerHTML = `<strong>${escapeHtml(it.title)}</strong> <span class="label">(${it.category})</span>`;
+  const meta = document.createElement("div");
+  meta.className = "small";
+  const merchant = it.merchant ? ` • ${escapeHtml(it.merchant)}` : "";
+  const link = it.link || "#";
+  meta.innerHTML = `${formatPrice(it.price, it.currency)}${merchant} — <a href="${link}" target="_blank" rel="noopener">bekijk</a>`;
+  col.appendChild(title);
+  col.appendChild(meta);
+  row.appendChild(img);
+  row.appendChild(col);
+  return row;
+}
+
+// Compact antwoord → gewone vorm: velden die wegvielen krijgen hun standaardwaarde terug
+function expand(data){
+  if(data.format !== "compact") return data;
+  const cur = data.currency || "EUR";
+  const items = data.items.map(it => ({currency: cur, merchant: "", image: null, ...it}));
+  return {...data, outfits: data.outfits.map(o => ({currency: cur, ...o, items: o.items.map(i => items[i])}))};
+}
+
+function renderOutfits(data, modeLabel="live"){
+  data = expand(data);
+  const view = renderShell(data.outfits.length, modeLabel);
+
+  data.outfits.forEach((out, n) => {
+    const card = view.cards[n];
+    card.querySelector("h3").textContent = out.name;
+    const total = card.querySelector(".total");
+    out.items.forEach(it => card.insertBefore(makeItemRow(it), total));
+    total.innerHTML = `<span class="label">Totaal</span><strong>${formatPrice(out.total, out.currency)}</strong>`;
+  });
+
+  renderFooter(data);
+}
 
+function renderFooter(data){
   addBubble(`Waarom dit werkt: ${escapeHtml(data.explanation)}`, "anna");
   addBubble(`Palet: ${data.palette.colors.slice(0,4).join(", ")}.`, "anna");
   addBubble(`Onthoud: ik ben onafhankelijk — geen affiliate of commissies.`, "anna");
+  addBubble(`Ander budget of aantal? Typ bijv. <strong>budget 300</strong> of <strong>4 outfits</strong>.`, "anna");
 }
 
 function formatPrice(value, currency="EUR"){